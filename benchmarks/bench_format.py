@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare the grid records formatting before and after humanize.format_*.
+
+    python3 benchmarks/bench_format.py --rows 200000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cromwellhelper.humanize as humanize  # noqa: E402
+import cromwellhelper.uge as uge  # noqa: E402
+
+
+def legacy_duration(d: datetime.timedelta) -> str:
+    # grid.duration before integer formatting
+    s = ''
+    if d.days > 0:
+        s += '{}d '.format(d.days)
+    sec = d.seconds
+    if sec > 60 * 60:
+        s += '{}h '.format(int(sec / (60 * 60)))
+        sec = sec % (60 * 60)
+    if sec > 60:
+        s += '{}m '.format(int(sec / (60)))
+        sec = sec % 60
+    s += '{}.{:03d}s'.format(int(sec), int(d.microseconds / 1000))
+    return s
+
+
+def legacy_row(one):
+    return (legacy_duration(datetime.timedelta(seconds=one[0])),
+            legacy_duration(datetime.timedelta(seconds=one[1])),
+            legacy_duration(datetime.timedelta(seconds=one[2])),
+            datetime.datetime.fromtimestamp(
+                one[3] / 1000).strftime('%Y/%m/%d %H:%M:%S'),
+            datetime.datetime.fromtimestamp(
+                one[4] / 1000).strftime('%Y/%m/%d %H:%M:%S'),
+            datetime.datetime.fromtimestamp(
+                one[5] / 1000).strftime('%Y/%m/%d %H:%M:%S'),
+            uge.human_memory_display.__wrapped__(one[6]),
+            uge.human_memory_display.__wrapped__(one[7]),
+            uge.human_memory_display.__wrapped__(one[8]))
+
+
+def fast_row(one):
+    return (humanize.format_duration(one[0]),
+            humanize.format_duration(one[1]),
+            humanize.format_duration(one[2]),
+            humanize.format_timestamp(one[3]),
+            humanize.format_timestamp(one[4]),
+            humanize.format_timestamp(one[5]),
+            uge.human_memory_display(one[6]),
+            uge.human_memory_display(one[7]),
+            uge.human_memory_display(one[8]))
+
+
+def synthetic_rows(count: int):
+    rand = random.Random(0)
+    rows = []
+    for i in range(count):
+        # array tasks are submitted together and often end close together
+        submission = 1600000000000 + (i // 100) * 60000
+        start = submission + rand.randint(0, 600) * 1000
+        wallclock = rand.randint(1000, 36000000)
+        slots = rand.choice([1, 2, 4, 8])
+        mem_req = rand.choice([1, 2, 4, 8]) * 1024 * 1024 * 1024
+        rows.append((wallclock / 1000, wallclock / 1000 * rand.random(),
+                     wallclock / 1000 * rand.random() * 0.1, submission,
+                     start, start + wallclock, mem_req * slots,
+                     mem_req * slots,
+                     rand.randint(1, 16 * 1024) * 1024 * 1024))
+    return rows
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='formatting benchmark')
+    parser.add_argument('--rows', type=int, default=200000)
+    options = parser.parse_args()
+
+    rows = synthetic_rows(options.rows)
+    for one in rows[:1000]:
+        assert legacy_row(one) == fast_row(one)
+
+    for label, formatter in [('legacy', legacy_row), ('fast', fast_row)]:
+        start = time.perf_counter()
+        for one in rows:
+            formatter(one)
+        elapsed = time.perf_counter() - start
+        print('{:>8}: {:8.3f} s {:12.0f} rows/s'.format(
+            label, elapsed, options.rows / elapsed))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare uge.load_data against the former row-by-row INSERT loop.
+
+    python3 benchmarks/bench_load_data.py --rows 200000 --processes 8
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cromwellhelper.uge as uge  # noqa: E402
+
+
+def synthetic_line(job_number: int, rand: random.Random) -> str:
+    submission = 1600000000000 + job_number * 1000
+    start = submission + rand.randint(0, 600000)
+    end = start + rand.randint(1000, 36000000)
+    slots = rand.choice([1, 1, 2, 4, 8])
+    wallclock = (end - start) / 1000
+    values = {
+        'qname': 'all.q',
+        'hostname': 'node{:03d}'.format(rand.randint(1, 128)),
+        'group': 'users',
+        'owner': 'user{:02d}'.format(rand.randint(1, 40)),
+        'job_name': 'cromwell_{:08x}_task{}'.format(job_number % 977,
+                                                    rand.randint(1, 30)),
+        'job_number': str(job_number),
+        'submission_time': str(submission),
+        'start_time': str(start),
+        'end_time': str(end),
+        'failed': '0',
+        'exit_status': str(rand.choice([0, 0, 0, 1])),
+        'ru_wallclock': '{:.3f}'.format(wallclock),
+        'ru_utime': '{:.3f}'.format(wallclock * slots * rand.random()),
+        'ru_stime': '{:.3f}'.format(wallclock * rand.random() * 0.1),
+        'slots': str(slots),
+        'task_number': '0',
+        'category': '-U users -l mem_req={0}G,s_vmem={0}G'.format(
+            rand.choice([1, 2, 4, 8])),
+        'maxvmem': str(rand.randint(1, 16 * 1024) * 1024 * 1024),
+        'wallclock': '{:.3f}'.format(wallclock),
+    }
+    return ':'.join(values.get(x[0], '0') for x in uge.ACCOUNTING_ITEMS)
+
+
+def write_accounting(path: str, rows: int):
+    rand = random.Random(0)
+    with open(path, 'w') as f:
+        print('# Version: 8.6.0', file=f)
+        for i in range(rows):
+            print(synthetic_line(i + 1, rand), file=f)
+
+
+def legacy_load_data(db: sqlite3.Connection, accounting):
+    # the per-row INSERT loop that uge.load_data used before batching
+    uge.create_tables(db)
+    while True:
+        line = accounting.readline()
+        if not line:
+            break
+        if line[0] == '#':
+            continue
+        row = line.strip().split(':')
+        row_data = {x[0]: y for (x, y) in zip(uge.ACCOUNTING_ITEMS, row)}
+        db.execute(
+            'INSERT INTO accounting(' +
+            ','.join(['"{}"'.format(x) for x in row_data]) + ') VALUES (' +
+            ','.join(['?' for x in row_data]) + ')',
+            [x for x in row_data.values()])
+    db.commit()
+
+
+def run(label: str, workdir: str, accounting_path: str, rows: int, load):
+    dbpath = os.path.join(workdir, label + '.sqlite3')
+    db = uge.connect_database(dbpath)
+    start = time.perf_counter()
+    load(db, accounting_path)
+    elapsed = time.perf_counter() - start
+    db.close()
+    print('{:>10}: {:8.2f} s {:12.0f} rows/s'.format(label, elapsed,
+                                                     rows / elapsed))
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='load_data benchmark')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=uge.DEFAULT_BATCH_SIZE)
+    parser.add_argument('--processes',
+                        type=int,
+                        nargs='*',
+                        default=[2, 4],
+                        help='process counts for the parallel loader')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        accounting_path = os.path.join(workdir, 'accounting')
+        write_accounting(accounting_path, options.rows)
+
+        def legacy(db, path):
+            with open(path, errors='ignore') as f:
+                legacy_load_data(db, f)
+
+        def batched(db, path):
+            with open(path, errors='ignore') as f:
+                uge.load_data(db, f, batch_size=options.batch_size)
+
+        run('legacy', workdir, accounting_path, options.rows, legacy)
+        run('batched', workdir, accounting_path, options.rows, batched)
+        for processes in options.processes:
+            run('parallel-{}'.format(processes), workdir, accounting_path,
+                options.rows,
+                lambda db, path: uge.load_data_parallel(
+                    db, path, processes=processes))
+
+
+if __name__ == '__main__':
+    _main()
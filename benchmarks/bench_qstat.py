@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare the streaming qstat parser with the former minidom parser.
+
+The recorded fixture in testfiles/uge/qstat.xml is repeated to the
+requested number of jobs.
+
+    python3 benchmarks/bench_qstat.py --jobs 50000
+"""
+
+import argparse
+import datetime
+import io
+import os
+import re
+import sys
+import time
+import tracemalloc
+import xml.dom.minidom
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cromwellhelper.uge as uge  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'testfiles', 'uge', 'qstat.xml')
+
+
+def build_xml(jobs: int) -> bytes:
+    with open(FIXTURE) as f:
+        fixture = f.read()
+    job_lists = re.findall(r'\s*<job_list .*?</job_list>', fixture, re.S)
+    body = []
+    for i in range(jobs):
+        body.append(job_lists[i % len(job_lists)].replace(
+            '<JB_job_number>', '<JB_job_number>{}'.format(i), 1))
+    return ('<?xml version=\'1.0\'?>\n<job_info>\n<job_info>' +
+            ''.join(body) + '\n</job_info>\n</job_info>\n').encode('utf-8')
+
+
+def legacy_parse(data: bytes):
+    # the minidom parser that uge.qstat used before streaming
+    dom = xml.dom.minidom.parseString(data)
+    jobs = []
+    for one_job in dom.getElementsByTagName('job_list'):
+        new_one = {}
+        for key, tag in [('name', 'JB_name'), ('job_id', 'JB_job_number'),
+                         ('owner', 'JB_owner'), ('state', 'state'),
+                         ('slots', 'slots'), ('priority', 'JAT_prio')]:
+            new_one[key] = one_job.getElementsByTagName(
+                tag)[0].firstChild.data.strip()
+        for key, tag in [('queue_name', 'queue_name'), ('tasks', 'tasks')]:
+            elements = one_job.getElementsByTagName(tag)
+            if elements and elements[0].firstChild:
+                new_one[key] = elements[0].firstChild.data.strip()
+        for key, tag in [('start_time', 'JAT_start_time'),
+                         ('submission_time', 'JB_submission_time')]:
+            elements = one_job.getElementsByTagName(tag)
+            if elements and elements[0].firstChild:
+                new_one[key] = datetime.datetime.strptime(
+                    elements[0].firstChild.data.strip(),
+                    uge.QSTAT_TIME_FORMAT)
+        jobs.append(new_one)
+    return iter(jobs)
+
+
+def run(label: str, data: bytes, parse):
+    start = time.perf_counter()
+    jobs = parse(data)
+    next(jobs)
+    first = time.perf_counter() - start
+    count = 1 + sum(1 for _ in jobs)
+    elapsed = time.perf_counter() - start
+
+    # tracemalloc slows parsing down, so memory is measured separately
+    tracemalloc.start()
+    for _ in parse(data):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('{:>10}: {} jobs, first job {:.3f} s, total {:.3f} s, '
+          'peak {:.1f} MB'.format(label, count, first, elapsed,
+                                  peak / 1024 / 1024))
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='qstat parser benchmark')
+    parser.add_argument('--jobs', type=int, default=50000)
+    options = parser.parse_args()
+
+    data = build_xml(options.jobs)
+    print('XML size: {:.1f} MB'.format(len(data) / 1024 / 1024))
+    run('minidom', data, legacy_parse)
+    run('iterparse', data,
+        lambda x: uge.parse_qstat_xml(io.BytesIO(x)))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare SELECT * against the column projection used by grid records.
+
+    python3 benchmarks/bench_records.py --rows 500000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cromwellhelper.grid as grid  # noqa: E402
+import cromwellhelper.uge as uge  # noqa: E402
+from bench_load_data import write_accounting  # noqa: E402
+
+
+def select_all(db, **kwargs):
+    # what grid records did before the projection
+    for one in uge.get_recent_data(db, **kwargs):
+        one = uge.add_info_to_record(dict(one))
+        one['owner'], one['cpu_use%'], one['maxvmem']
+
+
+def projected(db, **kwargs):
+    for one in uge.get_recent_data(db, columns=grid.RECORD_COLUMNS,
+                                   **kwargs):
+        one['owner'], one['cpu_use_percent'], one['maxvmem_bytes']
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='get_recent_data benchmark')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        accounting_path = os.path.join(workdir, 'accounting')
+        write_accounting(accounting_path, options.rows)
+        db = uge.connect_database(os.path.join(workdir, 'bench.sqlite3'))
+        with open(accounting_path, errors='ignore') as f:
+            uge.load_data(db, f)
+
+        # synthetic jobs ended in 2020; cover all of them
+        for label, kwargs in [
+            ('all users', {'owner': '*', 'days': 100000}),
+            ('one user', {'owner': 'user01', 'days': 100000}),
+            ('succeeded', {'owner': '*', 'days': 100000,
+                           'succeeded_only': True}),
+        ]:
+            for name, query in [('SELECT *', select_all),
+                                ('projected', projected)]:
+                best = None
+                for _ in range(options.repeat):
+                    start = time.perf_counter()
+                    query(db, **kwargs)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                print('{:>10} {:>10}: {:8.3f} s'.format(label, name, best))
+
+
+if __name__ == '__main__':
+    _main()
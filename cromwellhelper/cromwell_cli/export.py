@@ -41,6 +41,9 @@ def export(options):
     if not os.path.exists(options.output):
         os.makedirs(options.output)
 
+    # outputs of one workflow share most of their directories
+    resolver = fileutils.PathResolver()
+
     for one_output in collect_files(json_result['outputs']):
         if one_output not in output_candidates:
             print('Not found: ', one_output)
@@ -54,10 +57,11 @@ def export(options):
             print(output_path + " is already exists", file=sys.stderr)
             exit(1)
 
+        source_path = resolver.realpath(one_output)
         try:
-            os.link(fileutils.realpath(one_output), output_path)
+            os.link(source_path, output_path)
         except Exception:
-            shutil.copyfile(fileutils.realpath(one_output), output_path)
+            shutil.copyfile(source_path, output_path)
 
 
 def search_call_root(filepath: str) -> str:
@@ -1,7 +1,14 @@
 import re
 import hashlib
+import json
+import os
+import os.path
+import threading
+import time
 import typing
 import requests
+import requests.adapters
+import urllib3.util.retry
 
 BEARER = re.compile(
     r'Bearer realm="([\w.\-_/:]+)",service="([\w.\-_]+)",scope="([\w:\-_./]+)"'
@@ -9,6 +16,17 @@ BEARER = re.compile(
 BEARER_NO_SCOPE = re.compile(
     r'Bearer realm="([\w.\-_/:]+)",service="([\w.\-_]+)"')
 DEFAULT_REGISTRY = 'registry-1.docker.io'
+# (connect, read) in seconds
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+DEFAULT_POOL_SIZE = 16
+# registries may omit expires_in; the distribution spec defaults to 60
+DEFAULT_TOKEN_EXPIRES_IN = 60
+# do not send tokens that are about to expire in flight
+TOKEN_EXPIRY_MARGIN = 10
+REPOSITORY_URL = re.compile(
+    r'^\w+://([^/]+)/v2/(?:(.+)/(?:manifests|blobs|tags)/)?')
 
 
 class Manifest(typing.NamedTuple):
@@ -62,15 +80,19 @@ def parse_image_name(image_name: str,
     return ImageName(registry, name, reference, tag, display_name)
 
 
+MANIFEST_ACCEPT = 'application/vnd.docker.distribution.manifest.v2+json'
+
+
+def _manifest_url(image_name: ImageName) -> str:
+    return "https://{}/v2/{}/manifests/{}".format(image_name.registry,
+                                                  image_name.name,
+                                                  image_name.reference)
+
+
 def get_manifest(image_name: ImageName,
                  token: typing.Optional[str] = None) -> Manifest:
-    url = "https://{}/v2/{}/manifests/{}".format(image_name.registry,
-                                                 image_name.name,
-                                                 image_name.reference)
-    manifest, token = docker_api_call(
-        url,
-        {'Accept': 'application/vnd.docker.distribution.manifest.v2+json'},
-        token)
+    manifest, token = docker_api_call(_manifest_url(image_name),
+                                      {'Accept': MANIFEST_ACCEPT}, token)
 
     if 'Docker-Content-Digest' in manifest.headers:
         sha256hash = manifest.headers['Docker-Content-Digest']
@@ -86,41 +108,199 @@ def get_manifest(image_name: ImageName,
     )
 
 
+def get_manifest_digest(image_name: ImageName,
+                        token: typing.Optional[str] = None
+                        ) -> typing.Optional[str]:
+    # Docker Hub does not count HEAD requests against the pull
+    # rate limit
+    response, _ = docker_api_call(_manifest_url(image_name),
+                                  {'Accept': MANIFEST_ACCEPT},
+                                  token,
+                                  method='HEAD')
+    return response.headers.get('Docker-Content-Digest')
+
+
+_session: typing.Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    # shared by all registry requests; connection errors, 429 and 5xx
+    # are retried with backoff
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = urllib3.util.retry.Retry(
+                total=DEFAULT_RETRIES,
+                backoff_factor=DEFAULT_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                raise_on_status=False)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=DEFAULT_POOL_SIZE,
+                pool_maxsize=DEFAULT_POOL_SIZE,
+                max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+class TokenCache:
+    # bearer tokens keyed by realm, service and scope, and the
+    # challenge of each repository so that it is not asked twice
+    def __init__(self) -> None:
+        # "realm service scope" -> (token, expiry as UNIX time)
+        self.tokens: typing.Dict[str, typing.Tuple[str, float]] = dict()
+        # "host/repository" -> (realm, service, scope)
+        self.challenges: typing.Dict[str, typing.Tuple[str, str, str]] = \
+            dict()
+        self.lock = threading.Lock()
+
+    def get(self, realm: str, service: str,
+            scope: str) -> typing.Optional[str]:
+        with self.lock:
+            cached = self.tokens.get(' '.join((realm, service, scope)))
+        if cached is None or cached[1] < time.time() + TOKEN_EXPIRY_MARGIN:
+            return None
+        return cached[0]
+
+    def put(self, realm: str, service: str, scope: str, token: str,
+            expires_in: float) -> None:
+        with self.lock:
+            self.tokens[' '.join(
+                (realm, service, scope))] = (token, time.time() + expires_in)
+
+    def challenge(
+            self, key: str) -> typing.Optional[typing.Tuple[str, str, str]]:
+        with self.lock:
+            return self.challenges.get(key)
+
+    def put_challenge(self, key: str, challenge: typing.Tuple[str, str,
+                                                              str]) -> None:
+        with self.lock:
+            self.challenges[key] = challenge
+
+    def load(self, path: str) -> None:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self.lock:
+            for key, (token, expires) in data.get('tokens', {}).items():
+                if expires > now:
+                    self.tokens[key] = (token, expires)
+            for key, challenge in data.get('challenges', {}).items():
+                self.challenges[key] = tuple(challenge)
+
+    def save(self, path: str) -> None:
+        now = time.time()
+        with self.lock:
+            data = {
+                'tokens':
+                {k: v
+                 for k, v in self.tokens.items() if v[1] > now},
+                'challenges': self.challenges,
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        # tokens are credentials; keep them private to the user
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                          0o600), 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+
+
+TOKEN_CACHE = TokenCache()
+
+
+def _challenge_key(url: str) -> typing.Optional[str]:
+    match = REPOSITORY_URL.match(url)
+    if not match:
+        return None
+    return match.group(1) + '/' + (match.group(2) or '')
+
+
+def parse_challenge(www_authenticate: str) -> typing.Tuple[str, str, str]:
+    auth_info_re = BEARER.match(www_authenticate)
+    if auth_info_re:
+        return (auth_info_re.group(1), auth_info_re.group(2),
+                auth_info_re.group(3))
+    auth_info_re = BEARER_NO_SCOPE.match(www_authenticate)
+    if auth_info_re:
+        return (auth_info_re.group(1), auth_info_re.group(2), '')
+    raise Exception(
+        'Unexpected www-authenticate: {}'.format(www_authenticate))
+
+
+def get_token(realm: str,
+              service: str,
+              scope: str,
+              token_cache: typing.Optional[TokenCache] = None) -> str:
+    if token_cache is None:
+        token_cache = TOKEN_CACHE
+    token = token_cache.get(realm, service, scope)
+    if token is not None:
+        return token
+
+    auth_params = {'service': service}
+    if scope:
+        auth_params['scope'] = scope
+    auth_data = get_session().get(realm,
+                                  params=auth_params,
+                                  timeout=DEFAULT_TIMEOUT)
+    auth_data.raise_for_status()
+    auth_json = auth_data.json()
+    token = auth_json.get('token') or auth_json['access_token']
+    token_cache.put(realm, service, scope, token,
+                    auth_json.get('expires_in', DEFAULT_TOKEN_EXPIRES_IN))
+    return token
+
+
 def docker_api_call(url: str,
                     additional_headers: dict = {},
-                    token: typing.Optional[str] = None
+                    token: typing.Optional[str] = None,
+                    token_cache: typing.Optional[TokenCache] = None,
+                    method: str = 'GET'
                     ) -> typing.Tuple[requests.Response, typing.Optional[str]]:
+    if token_cache is None:
+        token_cache = TOKEN_CACHE
+    session = get_session()
     headers = {'Docker-Distribution-API-Version': 'registry/2.0'}
     headers.update(additional_headers)
+
+    key = _challenge_key(url)
+    if not token and key is not None:
+        challenge = token_cache.challenge(key)
+        if challenge is not None:
+            token = token_cache.get(*challenge)
     if token:
         headers['Authorization'] = 'Bearer ' + token
 
-    first_try = requests.get(url, headers=headers)
+    first_try = session.request(method,
+                                url,
+                                headers=headers,
+                                timeout=DEFAULT_TIMEOUT)
     if first_try.status_code == requests.codes.ok:
         return (first_try, token)
     if first_try.status_code != 401:
         first_try.raise_for_status()
 
-    auth_info_re = BEARER.match(first_try.headers['Www-Authenticate'])
-    if auth_info_re:
-        auth_params = {
-            'scope': auth_info_re.group(3),
-            'service': auth_info_re.group(2)
-        }
-    else:
-        auth_info_re = BEARER_NO_SCOPE.match(
-            first_try.headers['Www-Authenticate'])
-        if auth_info_re:
-            auth_params = {'service': auth_info_re.group(2)}
-        else:
-            raise Exception('Unexpected www-authenticate: {}'.format(
-                first_try.headers['Www-Authenticate']))
-
-    auth_data = requests.get(auth_info_re.group(1), params=auth_params)
-    auth_data.raise_for_status()
-    newtoken: str = auth_data.json()['token']
+    challenge = parse_challenge(first_try.headers['Www-Authenticate'])
+    if key is not None:
+        token_cache.put_challenge(key, challenge)
+    newtoken = get_token(*challenge, token_cache=token_cache)
+    if newtoken == token:
+        # the registry rejected a token we believed to be valid
+        token_cache.put(*challenge, newtoken, 0)
+        newtoken = get_token(*challenge, token_cache=token_cache)
     headers['Authorization'] = 'Bearer ' + newtoken
 
-    data = requests.get(url, headers=headers)
+    data = session.request(method,
+                           url,
+                           headers=headers,
+                           timeout=DEFAULT_TIMEOUT)
     data.raise_for_status()
     return (data, newtoken)
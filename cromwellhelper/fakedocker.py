@@ -34,7 +34,16 @@ def _main():
 def __main():
     parser = argparse.ArgumentParser(
         description="Singularity based fake docker")
-    parser.add_argument('--offline', action='store_true')
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='Resolve tags from the manifest cache and never build images')
+    parser.add_argument(
+        '--manifest-ttl',
+        type=float,
+        default=singularity.DEFAULT_MANIFEST_TTL,
+        help='Seconds a cached tag is used before it is revalidated ' +
+        'with a HEAD request (default: %(default)s)')
     parser.add_argument(
         '--image-store-path',
         default=os.path.expanduser('~/.cromwell/singularity'),
@@ -46,6 +55,10 @@ def __main():
     parser.add_argument('--default-registry',
                         default='registry-1.docker.io',
                         help='Default registry (default: %(default)s)')
+    parser.add_argument(
+        '--token-cache',
+        default=os.path.expanduser('~/.cromwell/registry-tokens.json'),
+        help='Registry token cache, empty to disable (default: %(default)s)')
     parser.set_defaults(func=None)
     subparsers = parser.add_subparsers()
 
@@ -54,6 +67,28 @@ def __main():
     pull_parser.add_argument('image_name',
                              help='Image name (NAME[:TAG|@DIGEST])')
 
+    pull_many_parser = subparsers.add_parser(
+        'pull-many', help='pull many images, building each digest once')
+    pull_many_parser.set_defaults(func=pull_many)
+    pull_many_parser.add_argument('image_names',
+                                  nargs='*',
+                                  help='Image name (NAME[:TAG|@DIGEST])')
+    pull_many_parser.add_argument(
+        '--file', '-f',
+        action='append',
+        help='Read image names from a file, one per line, such as the ' +
+        'output of cromwell-cli list-docker ("-" for stdin)')
+    pull_many_parser.add_argument(
+        '--resolve-workers',
+        help='Concurrent manifest requests (default: %(default)s)',
+        type=int,
+        default=singularity.DEFAULT_RESOLVE_WORKERS)
+    pull_many_parser.add_argument(
+        '--build-workers',
+        help='Concurrent singularity builds (default: %(default)s)',
+        type=int,
+        default=singularity.DEFAULT_BUILD_WORKERS)
+
     images_parser = subparsers.add_parser('images', help='list docker images')
     images_parser.set_defaults(func=images)
     images_parser.add_argument('--format', help='print format')
@@ -112,6 +147,28 @@ def __main():
     cromwell_singularity_run_parser.add_argument('--ref-cache',
                                                  help='htslib REF_CACHE directory (default: %(default)s)',
                                                  default="/share1/public/hts-ref")
+    cromwell_singularity_run_parser.add_argument(
+        '--max-binds',
+        help='Merge input directories until this many binds remain ' +
+        '(default: %(default)s)',
+        type=int,
+        default=singularity.DEFAULT_MAX_BINDS)
+    cromwell_singularity_run_parser.add_argument(
+        '--symlink-workers',
+        help='Threads searching inputs for symlinks, small directories ' +
+        'are searched serially (default: %(default)s)',
+        type=int,
+        default=8)
+    cromwell_singularity_run_parser.add_argument(
+        '--bind-min-depth',
+        help='Never bind directories with fewer path components ' +
+        '(default: %(default)s)',
+        type=int,
+        default=singularity.DEFAULT_BIND_MIN_DEPTH)
+
+    reindex_parser = subparsers.add_parser(
+        'reindex', help='rebuild the image store index')
+    reindex_parser.set_defaults(func=reindex)
 
     find_parser = subparsers.add_parser('find', help='find singularity image')
     find_parser.set_defaults(func=find)
@@ -177,8 +234,10 @@ def memory_per_core_run(options):
 
 def cromwell_singularity_run(options):
     # search "cromwell-execution" directory
-    workdir = fileutils.realpath(options.workdir)
-    execution_dir = fileutils.realpath(os.path.abspath(options.workdir))
+    # resolve the shared parts of the input paths only once
+    resolver = fileutils.PathResolver()
+    workdir = resolver.realpath(options.workdir)
+    execution_dir = resolver.realpath(os.path.abspath(options.workdir))
     while execution_dir and execution_dir != '/':
         if os.path.basename(execution_dir) == 'cromwell-executions':
             break
@@ -187,15 +246,10 @@ def cromwell_singularity_run(options):
 
     # create bind parameter
     BAD_CHARS = [',', ':', ' ']
-    binds = {
-        (options.script, options.script, options.script),
-    }
-    binds |= set(fileutils.search_symlinks(os.path.join(workdir, 'inputs')))
-
-    for one_pair in binds:
-        # print('PAIR: {}'.format(one_pair[0]), file=sys.stderr)
-        # print('   => {}'.format(one_pair[1]), file=sys.stderr)
-        # print('   => {}'.format(one_pair[2]), file=sys.stderr)
+    links = fileutils.search_symlinks(os.path.join(workdir, 'inputs'),
+                                      resolver, options.symlink_workers)
+
+    for one_pair in links + [(options.script, options.script, options.script)]:
         for one_path in one_pair:
             for one_bad in BAD_CHARS:
                 if one_bad in one_path:
@@ -204,21 +258,37 @@ def cromwell_singularity_run(options):
                           file=sys.stderr)
                     sys.exit(1)
 
-    bind_arg = ','.join([x[2] + ':' + x[1] + ':ro' for x in binds])
-    # print(bind_arg.replace(',', '\n'), file=sys.stderr)
+    # one bind per input makes singularity slow to start, or fail
+    plan = singularity.plan_binds(links, options.max_binds,
+                                  options.bind_min_depth)
+    print('bind plan: {} inputs => {} directories, {} files'.format(
+        len(links), len(plan.directories), len(plan.files)), file=logfile)
+    for one in plan.directories:
+        print('  directory {} => {}'.format(*one), file=logfile)
+    for one in plan.files:
+        print('  file {} => {}'.format(*one), file=logfile)
+    if len(plan.directories) + len(plan.files) > options.max_binds:
+        message = 'warning: bind plan exceeds --max-binds {}'.format(
+            options.max_binds)
+        print(message, file=logfile)
+        print(message, file=sys.stderr)
+
+    binds = [(options.script, options.script)]
+    binds += plan.directories
+    binds += plan.files
+    bind_arg = ','.join([x[0] + ':' + x[1] + ':ro' for x in binds])
 
     ACCEPT_BIND_LEN = 100000
 
     if len(bind_arg) > ACCEPT_BIND_LEN:
         bind_arg = ','.join([
-            x[2] + ':' + x[1] + ':ro' for x in binds
+            x[0] + ':' + x[1] + ':ro' for x in binds
             if not x[0].startswith(execution_dir) or not x[1].startswith(execution_dir)
         ])
 
         if bind_arg:
             bind_arg += ','
         bind_arg += '{}:{}:ro'.format(execution_dir, execution_dir)
-        # print(bind_arg.replace(',', '\n'))
     if bind_arg:
         bind_arg += ','
     bind_arg += '{}:{}:rw,'.format(workdir, options.docker_workdir)
@@ -236,7 +306,7 @@ def cromwell_singularity_run(options):
                                     options.default_registry)
     image_path = singularity.image_path(options.image_store_path, image)
     if os.path.islink(image_path):
-        image_path = fileutils.realpath(image_path)
+        image_path = resolver.realpath(image_path)
     if not os.path.isfile(image_path):
         print('image file is not found', file=sys.stderr)
         sys.exit(1)
@@ -327,13 +397,15 @@ def import_singularity(options):
                                     hash_name)
 
 
+def reindex(options):
+    index = singularity.build_index(options.image_store_path)
+    print('{} images indexed'.format(len(index['images'])), file=sys.stderr)
+
+
 def find(options):
     image = docker.parse_image_name(options.image, options.default_registry)
-    image_path = os.path.abspath(
-        singularity.image_path(options.image_store_path, image))
-    if os.path.islink(image_path):
-        image_path = fileutils.realpath(image_path)
-    if os.path.exists(image_path):
+    image_path = singularity.find_image(options.image_store_path, image)
+    if image_path:
         print(image_path)
     else:
         print('image file is not found', file=sys.stderr)
@@ -341,7 +413,8 @@ def find(options):
 
 
 def images(options):
-    hash2tag = singularity.list_images(options.image_store_path)
+    indexed = singularity.indexed_images(options.image_store_path)
+    hash2tag = {k: v.tags for k, v in indexed.items()}
 
     keys = list(hash2tag.keys())
     keys.sort(key=lambda x: x.display_name)
@@ -353,20 +426,18 @@ def images(options):
         for h in keys:
             tags = list(hash2tag[h])
             tags.sort(key=lambda x: x.reference)
-            image_path = singularity.image_path(options.image_store_path, h)
-            stat_result = os.stat(image_path)
             timediff = humanize.humanize_time_delta(
                 datetime.datetime.now() -
-                datetime.datetime.fromtimestamp(stat_result.st_mtime)) + ' ago'
-            warn = os.path.exists(image_path + '.warn')
+                datetime.datetime.fromtimestamp(indexed[h].mtime)) + ' ago'
+            warn = indexed[h].warn
 
             for tag in tags:
                 p.add_row(h.display_name, tag.reference, h.reference, timediff,
-                          humanize.humanize_bytes(stat_result.st_size),
+                          humanize.humanize_bytes(indexed[h].size),
                           'YES' if warn else '')
             if not tags:
                 p.add_row(h.display_name, '<none>', h.reference, timediff,
-                          humanize.humanize_bytes(stat_result.st_size),
+                          humanize.humanize_bytes(indexed[h].size),
                           'YES' if warn else '')
         p.p()
     elif options.digests and options.format == \
@@ -387,13 +458,60 @@ def images(options):
 
 
 def pull(options):
-    if options.offline:
-        print('Cannot pull image without internet connection.',
+    load_token_cache(options)
+    try:
+        singularity.pull_image(options.singularity_executable,
+                               options.image_store_path,
+                               docker.parse_image_name(options.image_name),
+                               options.manifest_ttl, options.offline)
+    finally:
+        save_token_cache(options)
+
+
+def load_token_cache(options):
+    if options.token_cache:
+        docker.TOKEN_CACHE.load(options.token_cache)
+
+
+def save_token_cache(options):
+    if not options.token_cache:
+        return
+    try:
+        docker.TOKEN_CACHE.save(options.token_cache)
+    except OSError as e:
+        print('Cannot write token cache: {}'.format(e), file=sys.stderr)
+
+
+def pull_many(options):
+    names = list(options.image_names)
+    for one in options.file or []:
+        f = sys.stdin if one == '-' else open(one)
+        try:
+            names.extend(x.strip() for x in f if x.strip())
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    if not names:
+        print('No image is provided.', file=sys.stderr)
+        sys.exit(1)
+
+    load_token_cache(options)
+    try:
+        failed = singularity.pull_images(
+            options.singularity_executable, options.image_store_path, [
+                docker.parse_image_name(x, options.default_registry)
+                for x in names
+            ], options.resolve_workers, options.build_workers,
+            options.manifest_ttl, options.offline)
+    finally:
+        save_token_cache(options)
+    for image_name, message in failed.items():
+        print('Failed to pull {}:{}: {}'.format(image_name.display_name,
+                                                image_name.reference,
+                                                message),
               file=sys.stderr)
+    if failed:
         sys.exit(1)
-    singularity.pull_image(options.singularity_executable,
-                           options.image_store_path,
-                           docker.parse_image_name(options.image_name))
 
 
 if __name__ == '__main__':
@@ -1,15 +1,35 @@
+import concurrent.futures
+import contextlib
+import fcntl
 import os
 import os.path
 import typing
 
 
+class PathResolver:
+    # paths sharing directories are resolved with one lookup per
+    # directory; use a new resolver when the file system may change
+    def __init__(self):
+        self.cache: typing.Dict[str, str] = dict()
+
+    def realpath(self, path: str) -> str:
+        if not path or path == '/':
+            return path
+        resolved = self.cache.get(path)
+        if resolved is not None:
+            return resolved
+
+        resolved = path
+        while os.path.islink(resolved):
+            resolved = readlink_abs(resolved)
+        resolved = os.path.join(self.realpath(os.path.dirname(resolved)),
+                                os.path.basename(resolved))
+        self.cache[path] = resolved
+        return resolved
+
+
 def realpath(path: str) -> str:
-    if not path or path == '/':
-        return path
-    while os.path.islink(path):
-        path = readlink_abs(path)
-    return os.path.join(realpath(os.path.dirname(path)),
-                        os.path.basename(path))
+    return PathResolver().realpath(path)
 
 
 def readlink_abs(path: str) -> str:
@@ -22,16 +42,105 @@ def create_relative_symlink(src: str, dest: str):
     os.symlink(relpath, dest)
 
 
-def search_symlinks(path: str) -> typing.List[typing.Tuple[str, str, str]]:
+# trees with fewer entries than this are walked without threads
+PARALLEL_MIN_ENTRIES = 64
+
+
+def open_shared(path: str, flags: int) -> int:
+    # every user sharing the directory can write the file
+    fd = os.open(path, flags | os.O_CREAT, 0o666)
+    try:
+        # the mode passed to os.open is narrowed by the umask
+        os.fchmod(fd, 0o666)
+    except OSError:
+        # created by another user, who has already opened it up
+        pass
+    return fd
+
+
+@contextlib.contextmanager
+def exclusive_lock(path: str) -> typing.Iterator[None]:
+    # any user may take the lock; a waiter that gets the lock on a
+    # file removed on release tries again with a new one
+    while True:
+        fd = open_shared(path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                locked = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                locked = False
+            if locked:
+                try:
+                    yield
+                finally:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        # e.g. another user's file in a sticky directory
+                        pass
+                return
+        finally:
+            os.close(fd)
+
+
+def _scan_directory(
+    path: str, resolver: PathResolver
+) -> typing.Tuple[typing.List[str], typing.List[typing.Tuple[str, str, str]]]:
+    directories: typing.List[str] = list()
+    link_list: typing.List[typing.Tuple[str, str, str]] = list()
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        return directories, link_list
+    with entries:
+        for one in entries:
+            # file types come from the directory listing; only symlinks
+            # need a stat to skip links to directories as os.walk does
+            if one.is_symlink():
+                if not one.is_dir():
+                    target = readlink_abs(one.path)
+                    link_list.append(
+                        (one.path, target, resolver.realpath(target)))
+            elif one.is_dir():
+                directories.append(one.path)
+    return directories, link_list
+
+
+def search_symlinks(
+        path: str,
+        resolver: typing.Optional[PathResolver] = None,
+        workers: int = 1) -> typing.List[typing.Tuple[str, str, str]]:
+    # (symlink, target, real path) of symlinks to files; with
+    # workers > 1 the order of the result is not defined
     path = os.path.abspath(path)
+    if resolver is None:
+        resolver = PathResolver()
 
-    link_list = list()
+    directories = [path]
+    link_list: typing.List[typing.Tuple[str, str, str]] = list()
+    scanned = 0
+    while directories and (workers <= 1 or scanned < PARALLEL_MIN_ENTRIES):
+        more, links = _scan_directory(directories.pop(), resolver)
+        directories += more
+        link_list += links
+        scanned += len(more) + len(links)
+    if not directories:
+        return link_list
 
-    for root, _dirs, files in os.walk(path):
-        for one_file in files:
-            one_path = os.path.join(root, one_file)
-            if os.path.islink(one_path):
-                link_list.append(
-                    (one_path, readlink_abs(one_path), realpath(one_path)))
+    # threads share the resolver cache; a race only repeats a lookup
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        running: typing.Set[concurrent.futures.Future] = set()
+        while directories or running:
+            while directories and len(running) < workers * 2:
+                running.add(
+                    executor.submit(_scan_directory, directories.pop(),
+                                    resolver))
+            done, running = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for one in done:
+                more, links = one.result()
+                directories += more
+                link_list += links
 
     return link_list
@@ -5,9 +5,14 @@ import argparse
 import os.path
 import sys
 import collections
+import curses
 import getpass
 import datetime
 import os
+import time
+import typing
+import fcntl
+import cromwellhelper.humanize as humanize
 import cromwellhelper.pager as pager
 import cromwellhelper.printtable as printtable
 import cromwellhelper.uge as uge
@@ -29,6 +34,10 @@ def __main():
     parser.add_argument('--no-pager',
                         action='store_true',
                         help='Do not use pager')
+    parser.add_argument('--qstat-cache',
+                        default=uge.get_default_qstat_cache_path(),
+                        help='qstat result cache, may be shared between ' +
+                        'users (default: %(default)s)')
     subparsers = parser.add_subparsers(required=True)
 
     stat_parser = subparsers.add_parser(
@@ -38,6 +47,16 @@ def __main():
                              '-u',
                              help='User name (default: %(default)s)',
                              default=getpass.getuser())
+    stat_parser.add_argument('--all-users-summary',
+                             action='store_true',
+                             help='Summarize the whole cluster, not only ' +
+                             '--user (runs qstat for every user)')
+    stat_parser.add_argument('--aggregate',
+                             '-a',
+                             action='store_true',
+                             help='Show one row per job, collapsing the ' +
+                             'tasks of array jobs')
+    add_max_age_argument(stat_parser)
 
     tablist_parser = subparsers.add_parser(
         'tablist', help='Tab separated list of running and pending jobs')
@@ -50,6 +69,27 @@ def __main():
                                 '-s',
                                 help='State (default: %(default)s)',
                                 default='*')
+    tablist_parser.add_argument('--queue',
+                                '-q',
+                                help='Queue (default: all queues)')
+    add_max_age_argument(tablist_parser)
+
+    top_parser = subparsers.add_parser(
+        'top', help='Live view of running and pending jobs')
+    top_parser.set_defaults(func=top, pager=False)
+    top_parser.add_argument('--user',
+                            '-u',
+                            help='Show jobs of this user only, per-user ' +
+                            'totals always cover the whole cluster ' +
+                            '(default: %(default)s)',
+                            default='*')
+    top_parser.add_argument('--interval',
+                            '-n',
+                            help='Refresh interval in seconds, qstat ' +
+                            'results are shared through --qstat-cache ' +
+                            '(default: %(default)s)',
+                            default=10,
+                            type=float)
 
     record_parser = subparsers.add_parser(
         'records', help='Show recent finished job records')
@@ -72,6 +112,23 @@ def __main():
                                type=int)
     record_parser.add_argument('--succeeded-only', action='store_true')
     record_parser.add_argument('--failed-only', action='store_true')
+    record_parser.add_argument('--min-cpu-use',
+                               help='Minimum CPU use%%',
+                               type=float)
+    record_parser.add_argument('--max-cpu-use',
+                               help='Maximum CPU use%%',
+                               type=float)
+    record_parser.add_argument('--min-memory-use',
+                               help='Minimum memory use%%',
+                               type=float)
+    record_parser.add_argument('--max-memory-use',
+                               help='Maximum memory use%%',
+                               type=float)
+    record_parser.add_argument('--sort',
+                               help='Sort order (default: %(default)s)',
+                               choices=list(uge.RECORD_ORDER.keys()),
+                               default='job')
+    add_staleness_argument(record_parser)
 
     show_parser = subparsers.add_parser('show', help='Show job detail')
     show_parser.set_defaults(func=detail)
@@ -79,6 +136,151 @@ def __main():
                              help='Database path (default: %(default)s)',
                              default=uge.get_default_database_path())
     show_parser.add_argument('job_id', help='Job ID')
+    show_parser.add_argument('--columns',
+                             '-c',
+                             nargs='+',
+                             help='Show only these accounting columns')
+    add_staleness_argument(show_parser)
+
+    summary_parser = subparsers.add_parser(
+        'summary', help='Summarize finished jobs per user, job, queue or day')
+    summary_parser.set_defaults(func=summary)
+    summary_parser.add_argument('--user',
+                                '-u',
+                                help='User name (default: %(default)s)',
+                                default='*')
+    summary_parser.add_argument('--by',
+                                help='Group by (default: %(default)s)',
+                                nargs='+',
+                                choices=list(uge.SUMMARY_GROUPS.keys()),
+                                default=['owner'])
+    summary_parser.add_argument('--tab-table', action='store_true')
+    summary_parser.add_argument('--database',
+                                help='Database path (default: %(default)s)',
+                                default=uge.get_default_database_path())
+    summary_parser.add_argument('--days',
+                                help='Days (default: %(default)s)',
+                                default=30,
+                                type=int)
+    summary_parser.add_argument('--hours',
+                                help='Hours (default: %(default)s)',
+                                default=0,
+                                type=int)
+    add_staleness_argument(summary_parser)
+
+    check_parser = subparsers.add_parser(
+        'check', help='List finished jobs with wrong resource requests')
+    check_parser.set_defaults(func=check_bad_parameters)
+    check_parser.add_argument('--user',
+                              '-u',
+                              help='User name (default: %(default)s)',
+                              default=getpass.getuser())
+    check_parser.add_argument('--tab-table', action='store_true')
+    check_parser.add_argument('--database',
+                              help='Database path (default: %(default)s)',
+                              default=uge.get_default_database_path())
+    check_parser.add_argument('--days',
+                              help='Days (default: %(default)s)',
+                              default=7,
+                              type=int)
+    check_parser.add_argument('--hours',
+                              help='Hours (default: %(default)s)',
+                              default=0,
+                              type=int)
+    check_parser.add_argument('--succeeded-only', action='store_true')
+    check_parser.add_argument('--failed-only', action='store_true')
+    add_staleness_argument(check_parser)
+
+    recommend_parser = subparsers.add_parser(
+        'recommend',
+        help='Suggest slots and mem_req per job from finished jobs')
+    recommend_parser.set_defaults(func=recommend)
+    recommend_parser.add_argument('--user',
+                                  '-u',
+                                  help='User name (default: %(default)s)',
+                                  default='*')
+    recommend_parser.add_argument(
+        '--by',
+        help='Group by Cromwell task name or full job name ' +
+        '(default: %(default)s)',
+        choices=list(uge.RECOMMEND_GROUPS.keys()),
+        default='task')
+    recommend_parser.add_argument('--percentile',
+                                  '-p',
+                                  help='Percentile of peak memory and CPU ' +
+                                  'use to cover (default: %(default)s)',
+                                  default=95,
+                                  type=float)
+    recommend_parser.add_argument('--margin',
+                                  help='Head room multiplied to peak ' +
+                                  'memory (default: %(default)s)',
+                                  default=1.2,
+                                  type=float)
+    recommend_parser.add_argument('--min-jobs',
+                                  help='Skip jobs with fewer succeeded ' +
+                                  'runs (default: %(default)s)',
+                                  default=5,
+                                  type=int)
+    recommend_parser.add_argument('--tab-table', action='store_true')
+    recommend_parser.add_argument('--database',
+                                  help='Database path (default: %(default)s)',
+                                  default=uge.get_default_database_path())
+    recommend_parser.add_argument('--days',
+                                  help='Days (default: %(default)s)',
+                                  default=90,
+                                  type=int)
+    recommend_parser.add_argument('--hours',
+                                  help='Hours (default: %(default)s)',
+                                  default=0,
+                                  type=int)
+    add_staleness_argument(recommend_parser)
+
+    export_parser = subparsers.add_parser(
+        'export',
+        help='Export finished job records to Parquet, Arrow IPC or CSV')
+    export_parser.set_defaults(func=export, pager=False)
+    export_parser.add_argument('output',
+                               help='Output file, "-" for CSV to stdout')
+    export_parser.add_argument('--format',
+                               '-f',
+                               choices=uge.EXPORT_FORMATS,
+                               help='Output format (default: guessed from ' +
+                               'the file name, CSV if unknown)')
+    export_parser.add_argument('--user',
+                               '-u',
+                               help='User name (default: %(default)s)',
+                               default='*')
+    export_parser.add_argument('--database',
+                               help='Database path (default: %(default)s)',
+                               default=uge.get_default_database_path())
+    export_parser.add_argument('--since',
+                               type=datetime.datetime.fromisoformat,
+                               help='Jobs finished after this date, ' +
+                               'e.g. 2020-06-01 (default: all jobs)')
+    export_parser.add_argument('--until',
+                               type=datetime.datetime.fromisoformat,
+                               help='Jobs finished up to this date')
+    export_parser.add_argument('--chunk-rows',
+                               help='Rows per row group (default: ' +
+                               '%(default)s)',
+                               default=uge.DEFAULT_EXPORT_ROWS,
+                               type=int)
+    add_staleness_argument(export_parser)
+
+    sync_parser = subparsers.add_parser(
+        'sync', help='Load new accounting records into the database')
+    sync_parser.set_defaults(func=sync, pager=False)
+    sync_parser.add_argument('--database',
+                             help='Database path (default: %(default)s)',
+                             default=uge.get_default_database_path())
+    sync_parser.add_argument('--daemon',
+                             action='store_true',
+                             help='Keep running and load appended records')
+    sync_parser.add_argument('--interval',
+                             help='Polling interval in seconds for ' +
+                             '--daemon (default: %(default)s)',
+                             default=10,
+                             type=float)
 
     if len(sys.argv) == 1:
         print("subcommand is required", file=sys.stderr)
@@ -86,43 +288,93 @@ def __main():
         return
 
     options = parser.parse_args()
+    if options.func is export and options.output == '-' and \
+       (options.format or 'csv') != 'csv':
+        parser.error('only CSV can be written to stdout')
 
-    pager.AutoPager(options.no_pager)
+    if getattr(options, 'pager', True):
+        pager.AutoPager(options.no_pager)
     options.func(options)
 
 
+def add_max_age_argument(subparser):
+    subparser.add_argument(
+        '--max-age',
+        help='Reuse qstat results up to this many seconds old, ' +
+        '0 to always run qstat (default: %(default)s)',
+        default=5,
+        type=float)
+
+
+def add_staleness_argument(subparser):
+    subparser.add_argument(
+        '--max-staleness',
+        help='Skip loading the accounting file if the database was ' +
+        'synchronized within this many seconds (default: %(default)s)',
+        default=60,
+        type=float)
+
+
+def update_database(db, database_path: str, max_staleness: float = 0,
+                    wait: bool = False):
+    last_sync = uge.get_last_sync(db)
+    if last_sync is not None and time.time() - last_sync < max_staleness:
+        return
+
+    with open(database_path + '.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            # another process such as "grid sync --daemon" is loading now
+            return
+        uge.load_accounting_files(db, uge.get_default_accounting_path())
+
+
+def sync(options):
+    db = uge.connect_database(options.database)
+    accounting = uge.get_default_accounting_path()
+    last_identity = None
+
+    while True:
+        try:
+            stat_result = os.stat(accounting)
+            identity = (stat_result.st_ino, stat_result.st_size,
+                        stat_result.st_mtime)
+        except FileNotFoundError:
+            # in the middle of rotation
+            identity = None
+
+        if identity is not None and identity != last_identity:
+            update_database(db, options.database, wait=True)
+            last_identity = identity
+        elif identity is not None:
+            # nothing was appended; the database is still up to date
+            uge.set_last_sync(db, time.time())
+            db.commit()
+
+        if not options.daemon:
+            break
+        time.sleep(options.interval)
+
+
 def duration(d: datetime.timedelta) -> str:
-    s = ''
-    if d.days > 0:
-        s += '{}d '.format(d.days)
-    sec = d.seconds
-    if sec > 60 * 60:
-        s += '{}h '.format(int(sec / (60 * 60)))
-        sec = sec % (60 * 60)
-    if sec > 60:
-        s += '{}m '.format(int(sec / (60)))
-        sec = sec % 60
-    s += '{}.{:03d}s'.format(int(sec), int(d.microseconds / 1000))
-    return s
+    return humanize.format_duration_microseconds(
+        (d.days * 24 * 60 * 60 + d.seconds) * 1000000 + d.microseconds)
 
 
 def detail(options):
     db = uge.connect_database(options.database)
-    with open(os.path.join(os.environ['SGE_ROOT'], os.environ['SGE_CELL'],
-                           'common/accounting'),
-              errors='ignore') as f:
-        uge.load_data(db, f)
+    update_database(db, options.database, options.max_staleness)
 
     job_id = options.job_id.split('.')
     if len(job_id) == 1:
-        job_number = int(job_id[0])
-        cur = db.execute('SELECT * FROM accounting WHERE job_number = ?',
-                         (job_number, ))
+        cur = uge.get_job_records(db, int(job_id[0]), columns=options.columns)
     elif len(job_id) == 2:
         (job_number, task_number) = [int(x) for x in job_id]
-        cur = db.execute(
-            'SELECT * FROM accounting WHERE job_number = ?' +
-            ' AND task_number = ?', (job_number, task_number))
+        cur = uge.get_job_records(db,
+                                  job_number,
+                                  task_number,
+                                  columns=options.columns)
     else:
         raise Exception('Invalid job ID: {}'.format(options.job_id))
 
@@ -131,8 +383,7 @@ def detail(options):
 
         for k, v in dict(one).items():
             if k == 'submission_time' or k == 'start_time' or k == 'end_time':
-                d = datetime.datetime.fromtimestamp(v / 1000)
-                v = d.strftime('%Y/%m/%d %H:%M:%S')
+                v = humanize.format_timestamp(v)
             elif k in {
                     'maxvmem', 'mem', 'total_mem_req', 'mem_req', 's_vmem',
                     'total_s_vmem'
@@ -142,7 +393,7 @@ def detail(options):
                     'wallclock', 'ru_utime', 'ru_stime', 'ru_wallclock',
                     'cpu_time', 'expected_cpu_time'
             }:
-                v = duration(datetime.timedelta(seconds=v))
+                v = humanize.format_duration(v)
             elif k in {'memory_use%', 'cpu_use%'}:
                 v = '{:.1f}%'.format(v)
             print('{:>18} : {}'.format(k, v))
@@ -150,38 +401,39 @@ def detail(options):
         print('-----------------')
 
 
+CHECK_COLUMNS = [
+    'qname', 'owner', 'hostname', 'job_number', 'task_number', 'job_name',
+    'slots', 'ru_wallclock', 'submission_time', 'mem_req', 's_vmem',
+    'maxvmem_bytes', 'memory_use_percent', 'cpu_use_percent'
+]
+
+
 def check_bad_parameters(options):
     db = uge.connect_database(options.database)
-    with open(os.path.join(os.environ['SGE_ROOT'], os.environ['SGE_CELL'],
-                           'common/accounting'),
-              errors='ignore') as f:
-        uge.load_data(db, f)
+    update_database(db, options.database, options.max_staleness)
     data = uge.get_recent_data(db,
                                owner=options.user,
                                days=options.days,
                                hours=options.hours,
                                succeeded_only=options.succeeded_only,
-                               failed_only=options.failed_only)
+                               failed_only=options.failed_only,
+                               columns=CHECK_COLUMNS)
 
+    # rows are printed while the query runs; widths come from the first rows
     if options.tab_table:
-        table = printtable.TabTable()
+        table = printtable.TabTable(stream=True)
     else:
-        table = printtable.PrettyTable()
+        table = printtable.PrettyTable(stream=True)
         table.add_row('queue', 'owner', 'hostname', 'job number',
                       'task number', 'job name', 'slots', 'wallclock',
                       'submission', 'mem req', 's_vmem', 'maxvmem',
                       'mem used%', 'cpu used%', 'reason')
 
     for one in data:
-        cpu_time = one['ru_utime'] + one['ru_stime']
-        wallclock = one['ru_wallclock']
-        wallclock_delta = datetime.timedelta(seconds=wallclock)
-        expected_cpu_time = wallclock * one['slots']
-        cpu_efficiency = cpu_time / expected_cpu_time
-        mem_req = uge.get_mem_req(one['category'])
-        s_vmem = uge.get_svmem(one['category'])
-        memory_efficiency = int(
-            one['maxvmem']) / (uge.get_mem_req(one['category']) * one['slots'])
+        cpu_efficiency = one['cpu_use_percent'] / 100
+        mem_req = one['mem_req']
+        s_vmem = one['s_vmem']
+        memory_efficiency = one['memory_use_percent'] / 100
 
         reason = []
 
@@ -196,92 +448,201 @@ def check_bad_parameters(options):
             table.add_row(
                 one['qname'], one['owner'], one['hostname'], one['job_number'],
                 one['task_number'], one['job_name'], one['slots'],
-                duration(wallclock_delta),
-                datetime.datetime.fromtimestamp(
-                    one['submission_time'] /
-                    1000).strftime('%Y/%m/%d %H:%M:%S'),
+                humanize.format_duration(one['ru_wallclock']),
+                humanize.format_timestamp(one['submission_time']),
                 uge.human_memory_display(mem_req),
                 uge.human_memory_display(s_vmem),
-                uge.human_memory_display(int(one['maxvmem'])),
+                uge.human_memory_display(one['maxvmem_bytes']),
                 '{:.3f}'.format(memory_efficiency),
                 '{:.3f}'.format(cpu_efficiency), ', '.join(reason))
 
     table.p()
 
 
+RECORD_COLUMNS = [
+    'owner', 'hostname', 'job_id', 'job_name', 'slots', 'wallclock',
+    'ru_utime', 'ru_stime', 'submission_time', 'start_time', 'end_time',
+    'total_mem_req', 'total_s_vmem', 'maxvmem_bytes', 'memory_use_percent',
+    'cpu_use_percent', 'exit_status', 'failed'
+]
+
+
+def recommend(options):
+    db = uge.connect_database(options.database)
+    update_database(db, options.database, options.max_staleness)
+    data = uge.get_recommendations(db,
+                                   options.by,
+                                   owner=options.user,
+                                   days=options.days,
+                                   hours=options.hours,
+                                   percentile=options.percentile,
+                                   margin=options.margin,
+                                   min_jobs=options.min_jobs)
+
+    if options.tab_table:
+        table = printtable.TabTable()
+    else:
+        table = printtable.PrettyTable()
+    percentile = 'p{:g}'.format(options.percentile)
+    table.add_row('job', 'jobs', 'slots', 'mem req', 's_vmem',
+                  'maxvmem ' + percentile, 'cpu use ' + percentile,
+                  'wallclock ' + percentile, 'new slots', 'new mem req',
+                  'new s_vmem', 'reserved GBh', 'new reserved GBh')
+    for one in data:
+        table.add_row(
+            one.name, one.jobs, one.slots,
+            uge.human_memory_display(one.mem_req),
+            uge.human_memory_display(one.s_vmem),
+            uge.human_memory_display(one.maxvmem),
+            '{:.2f}'.format(one.cpu_parallelism),
+            humanize.format_duration(one.wallclock),
+            one.recommended_slots,
+            uge.human_memory_display(one.recommended_mem_req),
+            uge.human_memory_display(one.recommended_mem_req),
+            '{:.1f}'.format(one.reserved_gb_hours),
+            '{:.1f}'.format(one.recommended_gb_hours))
+    table.p()
+
+
 def records(options):
     db = uge.connect_database(options.database)
-    with open(os.path.join(os.environ['SGE_ROOT'], os.environ['SGE_CELL'],
-                           'common/accounting'),
-              errors='ignore') as f:
-        uge.load_data(db, f)
+    update_database(db, options.database, options.max_staleness)
     data = uge.get_recent_data(db,
                                owner=options.user,
                                days=options.days,
                                hours=options.hours,
                                succeeded_only=options.succeeded_only,
-                               failed_only=options.failed_only)
-
+                               failed_only=options.failed_only,
+                               min_cpu_use=options.min_cpu_use,
+                               max_cpu_use=options.max_cpu_use,
+                               min_memory_use=options.min_memory_use,
+                               max_memory_use=options.max_memory_use,
+                               order_by=options.sort,
+                               columns=RECORD_COLUMNS)
+
+    # rows are printed while the query runs; widths come from the first rows
     if options.tab_table:
-        table = printtable.TabTable()
+        table = printtable.TabTable(stream=True)
         table.add_row('owner', 'hostname', 'job number', 'job name', 'slots',
                       'wallclock', 'user cpu', 'system cpu', 'submission',
                       'start', 'finished', 'mem req', 's_vmem', 'maxvmem',
                       'mem use%', 'cpu use%', 'exit_status', 'failed')
     else:
-        table = printtable.PrettyTable()
+        table = printtable.PrettyTable(stream=True)
         table.add_row('owner', 'hostname', 'job number', 'job name', 'slots',
                       'wallclock', 'user cpu', 'system cpu', 'submission',
                       'start', 'finished', 'mem req', 's_vmem', 'maxvmem',
                       'mem use%', 'cpu use%', 'exit_status', 'failed')
 
     for one in data:
-        one = uge.add_info_to_record(dict(one))
-
         table.add_row(
             one['owner'], one['hostname'], one['job_id'],
             one['job_name'], one['slots'],
-            duration(datetime.timedelta(seconds=one['wallclock'])),
-            duration(datetime.timedelta(seconds=one['ru_utime'])),
-            duration(datetime.timedelta(seconds=one['ru_stime'])),
-            datetime.datetime.fromtimestamp(
-                one['submission_time'] / 1000).strftime('%Y/%m/%d %H:%M:%S'),
-            datetime.datetime.fromtimestamp(
-                one['start_time'] / 1000).strftime('%Y/%m/%d %H:%M:%S'),
-            datetime.datetime.fromtimestamp(
-                one['end_time'] / 1000).strftime('%Y/%m/%d %H:%M:%S'),
+            humanize.format_duration(one['wallclock']),
+            humanize.format_duration(one['ru_utime']),
+            humanize.format_duration(one['ru_stime']),
+            humanize.format_timestamp(one['submission_time']),
+            humanize.format_timestamp(one['start_time']),
+            humanize.format_timestamp(one['end_time']),
             uge.human_memory_display(one['total_mem_req']),
             uge.human_memory_display(one['total_s_vmem']),
-            uge.human_memory_display(int(one['maxvmem'])),
-            '{:.1f}%'.format(one['memory_use%']),
-            '{:.1f}%'.format(one['cpu_use%']), one['exit_status'],
+            uge.human_memory_display(one['maxvmem_bytes']),
+            '{:.1f}%'.format(one['memory_use_percent']),
+            '{:.1f}%'.format(one['cpu_use_percent']), one['exit_status'],
             one['failed'])
 
     table.p()
 
 
+def export(options):
+    db = uge.connect_database(options.database)
+    update_database(db, options.database, options.max_staleness)
+    uge.export_records(db,
+                       options.output,
+                       format=options.format,
+                       owner=options.user,
+                       since=options.since,
+                       until=options.until,
+                       chunk_rows=options.chunk_rows)
+
+
+def summary(options):
+    db = uge.connect_database(options.database)
+    update_database(db, options.database, options.max_staleness)
+    data = uge.get_summary(db,
+                           options.by,
+                           owner=options.user,
+                           days=options.days,
+                           hours=options.hours)
+
+    if options.tab_table:
+        table = printtable.TabTable()
+    else:
+        table = printtable.PrettyTable()
+    table.add_row(*options.by, 'jobs', 'failed', 'slot hours',
+                  'idle slot hours', 'cpu use%', 'mem use%')
+
+    for one in data:
+        table.add_row(
+            *one[:len(options.by)], one['jobs'], one['failures'],
+            '{:.1f}'.format(one['slot_hours'] or 0),
+            '{:.1f}'.format(one['idle_slot_hours'] or 0),
+            '{:.1f}%'.format(one['cpu_use_percent'] or 0),
+            '{:.1f}%'.format(one['memory_use_percent'] or 0))
+
+    table.p()
+
+
 def tablist(options):
-    jobs = uge.qstat()
+    jobs = uge.cached_qstat(
+        options.qstat_cache, options.max_age,
+        uge.qstat_args(user=options.user,
+                       state=options.state,
+                       queue=options.queue))
 
     now = datetime.datetime.now()
-    table = printtable.TabTable()
+    table = printtable.TabTable(stream=True)
     for one in jobs:
-        if (one['owner'] == options.user
-                or options.user == '*') and (one['state'] == options.state
-                                             or options.state == '*'):
-            if 'start_time' in one:
-                time_display = duration(now - one['start_time'])
+        # a cached whole-cluster result is not filtered by qstat
+        if (one.owner == options.user
+                or options.user == '*') and (one.state == options.state
+                                             or options.state == '*') and \
+                uge.queue_matches(one.queue_name, options.queue):
+            if one.start_time is not None:
+                time_display = duration(now - one.start_time)
             else:
-                time_display = duration(now - one['submission_time'])
-            table.add_row(one['owner'], one['state'], one['priority'],
-                          one.get('queue_name', ''),
-                          one['job_id'], one['name'], one['slots'],
-                          one.get('tasks', ''), time_display)
+                time_display = duration(now - one.submission_time)
+            table.add_row(one.owner, one.state, one.priority,
+                          one.queue_name or '', one.job_id, one.name,
+                          one.slots, one.tasks or '', time_display)
+    table.p()
+
+
+def print_aggregated_jobs(groups: typing.Collection[uge.JobGroup],
+                          now: datetime.datetime):
+    if not groups:
+        return
+    table = printtable.PrettyTable()
+    table.add_row('Owner', 'JobID', 'Name', 'Slots', 'Tasks', 'Running',
+                  'Queued', 'Hold', 'Min running time', 'Max running time',
+                  'Waiting time')
+    for one in groups:
+        table.add_row(
+            one.owner, one.job_id, one.name, one.slots, one.task_range,
+            one.running, one.queued, one.hold,
+            duration(now - one.last_start) if one.last_start else '',
+            duration(now - one.first_start) if one.first_start else '',
+            duration(now - one.submission_time)
+            if one.submission_time else '')
+    print('-- Jobs ---------------------------')
     table.p()
 
 
 def stat(options):
-    jobs = uge.qstat()
+    jobs = uge.cached_qstat(
+        options.qstat_cache, options.max_age,
+        uge.qstat_args(user='*' if options.all_users_summary else
+                       options.user))
     running = collections.defaultdict(int)
     queued = collections.defaultdict(int)
     hold_queued = collections.defaultdict(int)
@@ -293,54 +654,59 @@ def stat(options):
     running_jobs = printtable.PrettyTable()
     running_jobs.add_row('Owner', 'Queue', 'JobID', 'Name', 'Slots',
                          'Running Time')
-    for one in jobs:
-        if (one['owner'] == options.user
-                or options.user == '*') and (one['state'] == 'r'
-                                             or one['state'] == 'Rr'):
-            running_jobs.add_row(one['owner'], one['queue_name'],
-                                 one['job_id'], one['name'], one['slots'],
-                                 duration(now - one['start_time']))
-    if len(running_jobs.rows) > 1:
-        print('-- Running jobs ---------------------------')
-        running_jobs.p()
-
     queued_jobs = printtable.PrettyTable()
     queued_jobs.add_row('Owner', 'JobID', 'Name', 'Slots', 'Tasks',
                         'Waiting time')
-    for one in jobs:
-        if (one['owner'] == options.user
-                or options.user == '*') and one['state'] == 'qw':
-            queued_jobs.add_row(one['owner'], one['job_id'], one['name'],
-                                one['slots'], one.get('tasks', ''),
-                                duration(now - one['submission_time']))
-    if len(queued_jobs.rows) > 1:
-        print('-- Queued jobs ---------------------------')
-        queued_jobs.p()
-
     hold_queued_jobs = printtable.PrettyTable()
     hold_queued_jobs.add_row('Owner', 'JobID', 'Name', 'Slots', 'Tasks',
                              'Waiting time')
+
+    # tasks are folded in as they stream by, never kept
+    groups: typing.Dict[str, uge.JobGroup] = collections.OrderedDict()
+
     for one in jobs:
-        if (one['owner'] == options.user
-                or options.user == '*') and one['state'] == 'hqw':
-            hold_queued_jobs.add_row(one['owner'], one['job_id'], one['name'],
-                                     one['slots'], one.get('tasks', ''),
-                                     duration(now - one['submission_time']))
+        owner = one.owner
+        show = options.user == '*' or owner == options.user
+        # a cached whole-cluster result may include other users
+        if not show and not options.all_users_summary:
+            continue
+        if show and options.aggregate:
+            uge.group_job(groups, one)
+        if one.state == 'r' or one.state == 'Rr':
+            running[owner] += 1
+            running_slots[owner] += int(one.slots)
+            if show and not options.aggregate:
+                running_jobs.add_row(owner, one.queue_name, one.job_id,
+                                     one.name, one.slots,
+                                     duration(now - one.start_time))
+        elif one.state == 'qw':
+            queued[owner] += 1
+            queued_slots[owner] += int(one.slots)
+            if show and not options.aggregate:
+                queued_jobs.add_row(owner, one.job_id, one.name, one.slots,
+                                    one.tasks or '',
+                                    duration(now - one.submission_time))
+        elif one.state == 'hqw':
+            hold_queued[owner] += 1
+            hold_queued_slots[owner] += int(one.slots)
+            if show and not options.aggregate:
+                hold_queued_jobs.add_row(owner, one.job_id, one.name,
+                                         one.slots, one.tasks or '',
+                                         duration(now - one.submission_time))
+
+    if options.aggregate:
+        print_aggregated_jobs(groups.values(), now)
+
+    if len(running_jobs.rows) > 1:
+        print('-- Running jobs ---------------------------')
+        running_jobs.p()
+    if len(queued_jobs.rows) > 1:
+        print('-- Queued jobs ---------------------------')
+        queued_jobs.p()
     if len(hold_queued_jobs.rows) > 1:
         print('-- Hold Queued jobs ---------------------------')
         hold_queued_jobs.p()
 
-    for one in jobs:
-        if one['state'] == 'r' or one['state'] == 'Rr':
-            running[one['owner']] += 1
-            running_slots[one['owner']] += int(one['slots'])
-        elif one['state'] == 'qw':
-            queued[one['owner']] += 1
-            queued_slots[one['owner']] += int(one['slots'])
-        elif one['state'] == 'hqw':
-            hold_queued[one['owner']] += 1
-            hold_queued_slots[one['owner']] += int(one['slots'])
-
     users = list(
         set(running.keys()) | set(queued.keys()) | set(hold_queued.keys()))
     users.sort(key=lambda x:
@@ -358,5 +724,114 @@ def stat(options):
     summary.p()
 
 
+TOP_JOB_HEADER = ('Owner', 'JobID', 'Name', 'Slots', 'Tasks', 'Running',
+                  'Queued', 'Hold', 'Since')
+TOP_USER_HEADER = ('User', 'Running slots', 'Queued slots', 'Hold slots')
+
+
+def top_rows(groups: typing.Iterable[uge.JobGroup]
+             ) -> typing.Dict[str, typing.Tuple[str, ...]]:
+    # timestamps rather than elapsed time, so a row only changes when
+    # the job itself does
+    rows = collections.OrderedDict()
+    for one in groups:
+        since = one.first_start or one.submission_time
+        rows[one.job_id] = (one.owner, one.job_id, one.name, str(one.slots),
+                            one.task_range, str(one.running),
+                            str(one.queued), str(one.hold),
+                            since.strftime('%m/%d %H:%M') if since else '')
+    return rows
+
+
+def top_user_rows(groups: typing.Iterable[uge.JobGroup]
+                  ) -> typing.List[typing.Tuple[str, ...]]:
+    running = collections.defaultdict(int)
+    queued = collections.defaultdict(int)
+    hold = collections.defaultdict(int)
+    for one in groups:
+        running[one.owner] += one.slots * one.running
+        queued[one.owner] += one.slots * one.queued
+        hold[one.owner] += one.slots * one.hold
+    users = sorted(running.keys(),
+                   key=lambda x: (running[x], queued[x], hold[x]),
+                   reverse=True)
+    return [(x, str(running[x]), str(queued[x]), str(hold[x]))
+            for x in users]
+
+
+def changed_rows(previous: typing.Dict[str, typing.Tuple[str, ...]],
+                 rows: typing.Dict[str, typing.Tuple[str, ...]]
+                 ) -> typing.Set[str]:
+    # none on the first screen
+    if not previous:
+        return set()
+    return set(k for k, v in rows.items() if previous.get(k) != v)
+
+
+def format_columns(rows: typing.List[typing.Tuple[str, ...]]
+                   ) -> typing.List[str]:
+    width = [max(len(x[i]) for x in rows) for i in range(len(rows[0]))]
+    return [
+        ' '.join(x.ljust(w) for x, w in zip(one, width)).rstrip()
+        for one in rows
+    ]
+
+
+def top(options):
+    try:
+        curses.wrapper(_top, options)
+    except KeyboardInterrupt:
+        pass
+
+
+def _top(screen, options):
+    try:
+        curses.curs_set(0)
+    except curses.error:
+        pass
+    screen.timeout(int(options.interval * 1000))
+
+    previous: typing.Dict[str, typing.Tuple[str, ...]] = {}
+    shown: typing.List[typing.Tuple[str, int]] = []
+    while True:
+        # concurrent viewers share one qstat per interval through the cache
+        groups = uge.aggregate_jobs(
+            uge.cached_qstat(options.qstat_cache, options.interval))
+        rows = top_rows(x for x in groups
+                        if options.user == '*' or x.owner == options.user)
+        changed = changed_rows(previous, rows)
+        previous = rows
+
+        lines = [('grid top  {}  {} jobs  (q to quit)'.format(
+            datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S'),
+            len(rows)), curses.A_REVERSE), ('', 0)]
+        lines += [(x, 0) for x in format_columns(
+            [TOP_USER_HEADER] + top_user_rows(groups))]
+        lines.append(('', 0))
+        job_lines = format_columns([TOP_JOB_HEADER] + list(rows.values()))
+        lines.append((job_lines[0], curses.A_UNDERLINE))
+        lines += [(x, curses.A_BOLD if k in changed else 0)
+                  for x, k in zip(job_lines[1:], rows.keys())]
+
+        # redraw only the lines that differ from the previous screen
+        height, width = screen.getmaxyx()
+        for i in range(min(max(len(lines), len(shown)), height)):
+            line = lines[i] if i < len(lines) else ('', 0)
+            if i < len(shown) and shown[i] == line:
+                continue
+            screen.move(i, 0)
+            screen.clrtoeol()
+            screen.addnstr(i, 0, line[0], width - 1, line[1])
+        shown = lines[:height]
+        screen.refresh()
+
+        key = screen.getch()
+        if key in (ord('q'), ord('Q')):
+            break
+        if key == curses.KEY_RESIZE:
+            screen.clear()
+            shown = []
+
+
 if __name__ == '__main__':
     _main()
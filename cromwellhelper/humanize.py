@@ -1,4 +1,5 @@
 import datetime
+import functools
 
 
 def humanize_bytes(byte_count: int, base: int = 1024) -> str:
@@ -37,3 +38,35 @@ def humanize_time_delta(d: datetime.timedelta) -> str:
     if hum == '1 seconds':
         return '1 second'
     return hum
+
+
+def format_duration_microseconds(microseconds: int) -> str:
+    # integer arithmetic, like 1d 2h 3m 4.567s
+    days, rest = divmod(microseconds, 24 * 60 * 60 * 1000000)
+    sec, microseconds = divmod(rest, 1000000)
+    s = ''
+    if days > 0:
+        s += '{}d '.format(days)
+    if sec > 60 * 60:
+        s += '{}h '.format(sec // (60 * 60))
+        sec = sec % (60 * 60)
+    if sec > 60:
+        s += '{}m '.format(sec // 60)
+        sec = sec % 60
+    return s + '{}.{:03d}s'.format(sec, microseconds // 1000)
+
+
+def format_duration(seconds: float) -> str:
+    # same rounding as datetime.timedelta(seconds=seconds)
+    return format_duration_microseconds(round(seconds * 1000000))
+
+
+@functools.lru_cache(maxsize=65536)
+def _format_second(second: int) -> str:
+    return datetime.datetime.fromtimestamp(second).strftime(
+        '%Y/%m/%d %H:%M:%S')
+
+
+def format_timestamp(milliseconds: int) -> str:
+    # timestamps within the same second share one strftime call
+    return _format_second(int(milliseconds // 1000))
@@ -4,11 +4,17 @@ import io
 
 
 class TabTable:
-    def __init__(self, print_header=True):
+    def __init__(self, print_header=True, stream=False, output=None):
         self.rows = list()
         self.print_header = print_header
+        self.stream = stream
+        self.output = output
 
     def add_row(self, *items):
+        if self.stream:
+            # write immediately instead of waiting for p()
+            print('\t'.join([str(x) for x in items]), file=self.output)
+            return
         self.rows.append(items)
 
     def p(self, output=None):
@@ -16,17 +22,46 @@ class TabTable:
             print('\t'.join([str(x) for x in one]), file=output)
 
 
+DEFAULT_LOOKAHEAD = 1000
+
+
 class PrettyTable:
-    def __init__(self, column_separator: str = ' | '):
+    # streaming tables fix column widths from widths and the first
+    # lookahead rows; a later wider cell shifts the rest of its row
+    def __init__(self,
+                 column_separator: str = ' | ',
+                 stream: bool = False,
+                 lookahead: int = DEFAULT_LOOKAHEAD,
+                 widths: typing.Optional[typing.Sequence[int]] = None,
+                 output: typing.Optional[io.TextIOBase] = None):
         self.rows: typing.List[typing.Tuple[str, ...]] = list()
         self.column_separator = column_separator
+        self.stream = stream
+        self.lookahead = lookahead
+        self.widths = list(widths) if widths else []
+        self.output = output
+        self.format_str: typing.Optional[str] = None
 
     def add_row(self, *items: str):
+        if self.format_str is not None:
+            print(self.format_str.format(*items), file=self.output)
+            return
         self.rows.append(items)
+        if self.stream and (len(self.rows) >= self.lookahead
+                            or len(self.widths) >= len(items)):
+            self.flush()
 
-    def p(self, output: typing.Optional[io.TextIOBase] = None):
+    def flush(self):
+        self.format_str = self._format_str()
+        for one in self.rows:
+            print(self.format_str.format(*one), file=self.output)
+        self.rows = list()
+
+    def _format_str(self) -> str:
         max_column_len: typing.DefaultDict[int, int] = collections.defaultdict(
             int)
+        for i, one_width in enumerate(self.widths):
+            max_column_len[i] = one_width
         for one_row in self.rows:
             for i, one_column in enumerate(one_row):
                 max_column_len[i] = max(len(str(one_column)),
@@ -39,6 +74,19 @@ class PrettyTable:
             if i != 0:
                 format_str += self.column_separator
             format_str += '{{:{}}}'.format(m)
+        return format_str
+
+    def p(self, output: typing.Optional[io.TextIOBase] = None):
+        if self.stream:
+            if output is not None and output is not self.output:
+                if self.format_str is not None:
+                    raise Exception('Rows were already printed to another '
+                                    'output')
+                self.output = output
+            if self.format_str is None:
+                self.flush()
+            return
 
+        format_str = self._format_str()
         for one in self.rows:
             print(format_str.format(*one), file=output)
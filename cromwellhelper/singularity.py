@@ -1,7 +1,13 @@
+import collections
+import concurrent.futures
+import errno
+import json
 import os
 import os.path
 import subprocess
 import sys
+import threading
+import time
 import typing
 
 import cromwellhelper.docker as docker
@@ -18,34 +24,225 @@ def image_path(store_path: str, image_name: docker.ImageName) -> str:
         image_name.display_name + "@" + image_name.reference + ".sif")
 
 
-def pull_image(singularity_executable: str, store_path: str,
-               image_name: docker.ImageName) -> None:
-    if image_name.is_tag:
-        manifest = docker.get_manifest(image_name)
-        hash_name = docker.ImageName(image_name.registry, image_name.name,
-                                     manifest.sha256hash, False,
-                                     image_name.display_name)
-    else:
-        hash_name = image_name
+MANIFEST_DIR = 'manifests'
+DEFAULT_MANIFEST_TTL = 300
+
+
+class CachedManifest(typing.NamedTuple):
+    sha256hash: str
+    manifest_json: str
+    # UNIX time of the last fetch or revalidation
+    fetched: float
+
+
+def manifest_cache_path(store_path: str, image_name: docker.ImageName) -> str:
+    return os.path.join(
+        store_path, MANIFEST_DIR,
+        image_name.display_name + ":" + image_name.reference + ".json")
+
+
+def load_manifest(store_path: str,
+                  image_name: docker.ImageName
+                  ) -> typing.Optional[CachedManifest]:
+    try:
+        with open(manifest_cache_path(store_path, image_name)) as f:
+            data = json.load(f)
+        return CachedManifest(data['sha256hash'], data['manifest_json'],
+                              data['fetched'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_manifest(store_path: str, image_name: docker.ImageName,
+                  manifest: CachedManifest) -> None:
+    cache_path = manifest_cache_path(store_path, image_name)
+    temp_path = '{}.{}.{}.tmp'.format(cache_path, os.getpid(),
+                                      threading.get_ident())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, 'w') as f:
+            json.dump(manifest._asdict(), f)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        # a read-only store still resolves tags from the registry
+        print('Cannot write manifest cache: {}'.format(e), file=sys.stderr)
+
+
+def resolve_image(image_name: docker.ImageName,
+                  store_path: typing.Optional[str] = None,
+                  manifest_ttl: float = DEFAULT_MANIFEST_TTL,
+                  offline: bool = False) -> docker.ImageName:
+    # manifests younger than manifest_ttl are used as is, older ones
+    # are revalidated with a HEAD request
+    if not image_name.is_tag:
+        return image_name
+
+    def digest(sha256hash: str) -> docker.ImageName:
+        return docker.ImageName(image_name.registry, image_name.name,
+                                sha256hash, False, image_name.display_name)
+
+    if store_path is None:
+        return digest(docker.get_manifest(image_name).sha256hash)
+
+    cached = load_manifest(store_path, image_name)
+    if offline:
+        if cached is None:
+            raise Exception('No cached manifest for {}:{}'.format(
+                image_name.display_name, image_name.reference))
+        return digest(cached.sha256hash)
+
+    now = time.time()
+    if cached is not None:
+        if now - cached.fetched < manifest_ttl:
+            return digest(cached.sha256hash)
+        if docker.get_manifest_digest(image_name) == cached.sha256hash:
+            save_manifest(store_path, image_name, cached._replace(fetched=now))
+            return digest(cached.sha256hash)
+
+    manifest = docker.get_manifest(image_name)
+    save_manifest(
+        store_path, image_name,
+        CachedManifest(manifest.sha256hash, manifest.manifest_json, now))
+    return digest(manifest.sha256hash)
+
 
+def pull_image(singularity_executable: str,
+               store_path: str,
+               image_name: docker.ImageName,
+               manifest_ttl: float = DEFAULT_MANIFEST_TTL,
+               offline: bool = False) -> None:
+    hash_name = resolve_image(image_name, store_path, manifest_ttl, offline)
     hash_path = os.path.abspath(image_path(store_path, hash_name))
     print(hash_path)
-    if os.path.exists(hash_path):
-        if image_name.is_tag:
-            update_tag_link(store_path, image_name, hash_name)
+    if offline and not os.path.exists(hash_path):
+        raise Exception('Cannot pull image without internet connection: '
+                        '{}@{}'.format(hash_name.display_name,
+                                       hash_name.reference))
+    tag_names = [image_name] if image_name.is_tag else []
+    if not install_image(singularity_executable, store_path, hash_name,
+                         tag_names):
         print('Image is up to date', file=sys.stderr)
-        return
 
-    os.makedirs(os.path.dirname(hash_path), exist_ok=True)
-    subprocess.call([
-        singularity_executable, 'build', hash_path, 'docker://' +
-        hash_name.registry + '/' + hash_name.name + "@" + hash_name.reference
-    ])
-    if image_name.is_tag:
-        update_tag_link(store_path, image_name, hash_name)
 
+def install_image(singularity_executable: str,
+                  store_path: str,
+                  hash_name: docker.ImageName,
+                  tag_names: typing.Iterable[docker.ImageName] = (),
+                  quiet: bool = False) -> bool:
+    # returns True if the image was built by this call
+    hash_path = os.path.abspath(image_path(store_path, hash_name))
+    built = False
+    if not os.path.exists(hash_path):
+        os.makedirs(os.path.dirname(hash_path), exist_ok=True)
+        # one process builds each digest; the others wait and reuse it
+        with fileutils.exclusive_lock(hash_path + '.lock'):
+            if os.path.exists(hash_path):
+                print('Image was pulled by another process', file=sys.stderr)
+            else:
+                build_image(singularity_executable, hash_path, hash_name,
+                            quiet)
+                built = True
+
+    for tag_name in tag_names:
+        update_tag_link(store_path, tag_name, hash_name)
+    return built
+
+
+DEFAULT_RESOLVE_WORKERS = 8
+DEFAULT_BUILD_WORKERS = 2
+
+
+def pull_images(
+        singularity_executable: str,
+        store_path: str,
+        image_names: typing.Iterable[docker.ImageName],
+        resolve_workers: int = DEFAULT_RESOLVE_WORKERS,
+        build_workers: int = DEFAULT_BUILD_WORKERS,
+        manifest_ttl: float = DEFAULT_MANIFEST_TTL,
+        offline: bool = False) -> typing.Dict[docker.ImageName, str]:
+    # tags are resolved concurrently, then each distinct digest is
+    # built once; returns error messages of images that failed
+    image_names = list(dict.fromkeys(image_names))
+    failed: typing.Dict[docker.ImageName, str] = dict()
+    requested: typing.Dict[docker.ImageName,
+                           typing.List[docker.ImageName]] = dict()
+
+    with concurrent.futures.ThreadPoolExecutor(resolve_workers) as executor:
+        futures = {
+            executor.submit(resolve_image, x, store_path, manifest_ttl,
+                            offline): x
+            for x in image_names
+        }
+        for future in concurrent.futures.as_completed(futures):
+            image_name = futures[future]
+            try:
+                hash_name = future.result()
+            except Exception as e:
+                failed[image_name] = str(e)
+                print('Cannot resolve {}:{}: {}'.format(
+                    image_name.display_name, image_name.reference, e),
+                      file=sys.stderr)
+                continue
+            requested.setdefault(hash_name, []).append(image_name)
+    print('{} images resolved to {} digests'.format(
+        len(image_names) - len(failed), len(requested)),
+          file=sys.stderr)
+
+    if offline:
+        for hash_name in list(requested.keys()):
+            if not os.path.exists(image_path(store_path, hash_name)):
+                for one in requested.pop(hash_name):
+                    failed[one] = 'Image is not in the store'
+
+    with concurrent.futures.ThreadPoolExecutor(build_workers) as executor:
+        futures = {
+            executor.submit(install_image, singularity_executable,
+                            store_path, k, [x for x in v if x.is_tag],
+                            quiet=True): k
+            for k, v in requested.items()
+        }
+        for i, future in enumerate(concurrent.futures.as_completed(futures),
+                                   1):
+            hash_name = futures[future]
+            try:
+                status = 'built' if future.result() else 'up to date'
+            except Exception as e:
+                status = 'failed'
+                for one in requested[hash_name]:
+                    failed[one] = str(e)
+            print('[{}/{}] {} {}@{}'.format(i, len(futures), status,
+                                            hash_name.display_name,
+                                            hash_name.reference),
+                  file=sys.stderr)
+    return failed
+
+
+def build_image(singularity_executable: str,
+                hash_path: str,
+                hash_name: docker.ImageName,
+                quiet: bool = False) -> None:
+    # build next to the final path so that the rename is atomic and an
+    # interrupted build never leaves a truncated image behind
+    temp_path = '{}.{}.tmp'.format(hash_path, os.getpid())
+    # parallel builds would interleave their progress output
+    stdout = subprocess.DEVNULL if quiet else None
+    try:
+        returncode = subprocess.call([
+            singularity_executable, 'build', temp_path,
+            'docker://' + hash_name.registry + '/' + hash_name.name + "@" +
+            hash_name.reference
+        ], stdout=stdout)
+        if returncode != 0 or not os.path.isfile(temp_path):
+            raise Exception('Failed to build image: {}@{}'.format(
+                hash_name.display_name, hash_name.reference))
+        os.replace(temp_path, hash_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
-def update_tag_link(store_path: str, tag_name: docker.ImageName,
+
+def update_tag_link(store_path: str,
+                    tag_name: docker.ImageName,
                     hash_name: docker.ImageName) -> None:
     assert tag_name.is_tag
     assert not hash_name.is_tag
@@ -57,10 +254,15 @@ def update_tag_link(store_path: str, tag_name: docker.ImageName,
         if os.path.abspath(fileutils.readlink_abs(tag_path)) == hash_path:
             # update path is not required
             return
-        os.remove(tag_path)
+    elif os.path.exists(tag_path):
+        raise FileExistsError(errno.EEXIST, 'Tag is not a symbolic link',
+                              tag_path)
 
     os.makedirs(os.path.dirname(tag_path), exist_ok=True)
-    fileutils.create_relative_symlink(hash_path, tag_path)
+    # swap the link in one rename; readers never see a missing tag
+    temp_path = '{}.{}.tmp'.format(tag_path, os.getpid())
+    fileutils.create_relative_symlink(hash_path, temp_path)
+    os.replace(temp_path, tag_path)
     print("link {} => {}".format(tag_path, hash_path))
 
 
@@ -104,3 +306,230 @@ def list_images(
             hash_to_tag[hash_name].add(tag_name)
 
     return hash_to_tag
+
+
+# the index is written by readers finding it stale, not by every change
+# to the store, which would always leave it inside the racy window
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+# directory mtimes this close to the index creation time may hide changes
+# made in the same tick, as on file systems with coarse timestamps
+INDEX_RACY_NS = 2 * 1000000000
+
+
+class IndexedImage(typing.NamedTuple):
+    size: int
+    mtime: float
+    warn: bool
+    tags: typing.Set[docker.ImageName]
+
+
+def _index_stamp(store_path: str) -> typing.Dict[str, int]:
+    # adding, removing or renaming an entry changes its directory mtime
+    stamp = dict()
+    for one in ('tag', 'sha256'):
+        for root, _dirs, _files in os.walk(os.path.join(store_path, one)):
+            stamp[os.path.relpath(root, store_path)] = \
+                os.stat(root).st_mtime_ns
+    return stamp
+
+
+def build_index(store_path: str) -> typing.Dict[str, typing.Any]:
+    store_path = os.path.realpath(store_path)
+    created = time.time_ns()
+    stamp = _index_stamp(store_path)
+    images = dict()
+    for hash_name, tags in list_images(store_path).items():
+        one_path = image_path(store_path, hash_name)
+        stat_result = os.stat(one_path)
+        images[hash_name.display_name + '@' + hash_name.reference] = {
+            'size': stat_result.st_size,
+            'mtime': stat_result.st_mtime,
+            'warn': os.path.exists(one_path + '.warn'),
+            'tags': sorted(x.display_name + ':' + x.reference for x in tags),
+        }
+    index = {
+        'version': INDEX_VERSION,
+        'created': created,
+        'stamp': stamp,
+        'images': images
+    }
+
+    index_path = os.path.join(store_path, INDEX_NAME)
+    temp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+    except OSError as e:
+        # a read-only store still works without the index
+        print('Cannot write image index: {}'.format(e), file=sys.stderr)
+    return index
+
+
+def load_index(
+        store_path: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    # None if the store has changed since the index was written
+    store_path = os.path.realpath(store_path)
+    try:
+        with open(os.path.join(store_path, INDEX_NAME)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != INDEX_VERSION:
+        return None
+    try:
+        for one, mtime in index['stamp'].items():
+            if os.stat(os.path.join(store_path, one)).st_mtime_ns != mtime or \
+               mtime > index['created'] - INDEX_RACY_NS:
+                return None
+        # a new top level directory would not be in the stamp
+        for one in ('tag', 'sha256'):
+            if one not in index['stamp'] and \
+               os.path.isdir(os.path.join(store_path, one)):
+                return None
+    except OSError:
+        return None
+    return index
+
+
+def indexed_images(
+        store_path: str) -> typing.Dict[docker.ImageName, IndexedImage]:
+    # a stale index is rebuilt here
+    index = load_index(store_path)
+    if index is None:
+        index = build_index(store_path)
+    return {
+        docker.parse_image_name(k): IndexedImage(
+            v['size'], v['mtime'], v['warn'],
+            set(docker.parse_image_name(x) for x in v['tags']))
+        for k, v in index['images'].items()
+    }
+
+
+def find_image(store_path: str,
+               image_name: docker.ImageName) -> typing.Optional[str]:
+    # compare as image_path does; index entries carry the default registry
+    def key(x: docker.ImageName) -> typing.Tuple[str, str, bool]:
+        return (x.display_name, x.reference, x.is_tag)
+
+    for hash_name, one in indexed_images(store_path).items():
+        if key(hash_name) == key(image_name) or \
+           key(image_name) in set(key(x) for x in one.tags):
+            return os.path.join(os.path.realpath(store_path),
+                                image_path('', hash_name))
+    return None
+
+
+DEFAULT_MAX_BINDS = 64
+DEFAULT_BIND_MIN_DEPTH = 2
+
+
+class BindPlan(typing.NamedTuple):
+    # (source, destination) directory pairs bound read-only
+    directories: typing.List[typing.Tuple[str, str]]
+    # (source, destination) file pairs bound read-only
+    files: typing.List[typing.Tuple[str, str]]
+
+
+def _depth(path: str) -> int:
+    return path.rstrip('/').count('/')
+
+
+def _covers(parent: typing.Tuple[str, str],
+            child: typing.Tuple[str, str]) -> bool:
+    suffix = child[1][len(parent[1]):]
+    return child[1].startswith(parent[1] + '/') and \
+        child[0] == parent[0] + suffix
+
+
+def _remove_nested(
+    directories: typing.Iterable[typing.Tuple[str, str]]
+) -> typing.Set[typing.Tuple[str, str]]:
+    result: typing.Set[typing.Tuple[str, str]] = set()
+    ancestors: typing.List[typing.Tuple[str, str]] = []
+    for one in sorted(directories, key=lambda x: x[1].split('/')):
+        while ancestors and not one[1].startswith(ancestors[-1][1] + '/'):
+            ancestors.pop()
+        if any(_covers(x, one) for x in ancestors):
+            continue
+        result.add(one)
+        ancestors.append(one)
+    return result
+
+
+def _parent(directory: typing.Tuple[str, str]
+            ) -> typing.Optional[typing.Tuple[str, str]]:
+    # a directory bound elsewhere moves up only along matching names
+    if os.path.basename(directory[0]) != os.path.basename(directory[1]):
+        return None
+    return (os.path.dirname(directory[0]), os.path.dirname(directory[1]))
+
+
+def plan_binds(links: typing.Iterable[typing.Tuple[str, str, str]],
+               max_binds: int = DEFAULT_MAX_BINDS,
+               min_depth: int = DEFAULT_BIND_MIN_DEPTH) -> BindPlan:
+    # links are (link, target, real path); real directories are bound
+    # at the target's directory and merged down to max_binds binds
+    files: typing.Set[typing.Tuple[str, str]] = set()
+    candidates: typing.Set[typing.Tuple[str, str]] = set()
+    for _, target, real in links:
+        if target == real or (
+                os.path.basename(target) == os.path.basename(real)
+                and not os.path.islink(target)):
+            # the target's directory is, or resolves to, the real one
+            candidates.add((real, target))
+        else:
+            files.add((real, target))
+
+    blocked: typing.Set[str] = set()
+    for _, target in files:
+        parent = os.path.dirname(target)
+        while parent not in blocked and parent != '/':
+            blocked.add(parent)
+            parent = os.path.dirname(parent)
+
+    def bindable(directory: typing.Tuple[str, str]) -> bool:
+        return min(_depth(directory[0]), _depth(directory[1])) >= \
+            min_depth and directory[1] not in blocked
+
+    directories: typing.Set[typing.Tuple[str, str]] = set()
+    for one in candidates:
+        parent = (os.path.dirname(one[0]), os.path.dirname(one[1]))
+        if bindable(parent):
+            directories.add(parent)
+        else:
+            files.add(one)
+    directories = _remove_nested(directories)
+
+    while len(directories) + len(files) > max_binds:
+        children: typing.DefaultDict[typing.Tuple[str, str], typing.List[
+            typing.Tuple[str, str]]] = collections.defaultdict(list)
+        for one in directories:
+            parent = _parent(one)
+            if parent is not None and bindable(parent):
+                children[parent].append(one)
+        if not children:
+            break
+
+        merges = sorted([x for x in children.items() if len(x[1]) > 1],
+                        key=lambda x: (_depth(x[0][1]), len(x[1])),
+                        reverse=True)
+        if merges:
+            excess = len(directories) + len(files) - max_binds
+            for parent, one_children in merges:
+                if excess <= 0:
+                    break
+                directories.difference_update(one_children)
+                directories.add(parent)
+                excess -= len(one_children) - 1
+        else:
+            # nothing shares a parent yet; move the deepest ones up a level
+            deepest = max(_depth(x[1]) for x in children)
+            for parent, one_children in children.items():
+                if _depth(parent[1]) == deepest:
+                    directories.difference_update(one_children)
+                    directories.add(parent)
+        directories = _remove_nested(directories)
+
+    return BindPlan(sorted(directories), sorted(files))
@@ -9,8 +9,25 @@ import getpass
 import datetime
 import re
 import subprocess
-import xml.dom.minidom  # type: ignore
+import gzip
+import bz2
+import lzma
+import hashlib
+import io
+import time
+import collections
+import multiprocessing
+import functools
+import itertools
+import json
+import fcntl
+import fnmatch
+import xml.etree.ElementTree as ElementTree
 import sys
+import csv
+import math
+
+import cromwellhelper.fileutils as fileutils
 
 ACCOUNTING_ITEMS = [
     ("qname", "TEXT"),
@@ -70,6 +87,29 @@ ACCOUNTING_ITEMS = [
     ("bound_cores", "INTEGER"),
 ]
 
+ACCOUNTING_INDEX = {x[0]: i for i, x in enumerate(ACCOUNTING_ITEMS)}
+
+# computed once at load time from the columns in DERIVED_SOURCE
+DERIVED_ITEMS = [
+    ("job_id", "TEXT"),
+    ("cpu_time", "REAL"),
+    ("expected_cpu_time", "REAL"),
+    ("cpu_use_percent", "REAL"),
+    ("mem_req", "INTEGER"),
+    ("total_mem_req", "INTEGER"),
+    ("s_vmem", "INTEGER"),
+    ("total_s_vmem", "INTEGER"),
+    ("maxvmem_bytes", "INTEGER"),
+    ("memory_use_percent", "REAL"),
+]
+
+DERIVED_SOURCE = [
+    'job_number', 'task_number', 'ru_wallclock', 'ru_utime', 'ru_stime',
+    'slots', 'category', 'maxvmem'
+]
+
+SCHEMA_VERSION = 1
+
 
 def _main():
     parser = argparse.ArgumentParser(description="UGE Accounting Loader")
@@ -77,50 +117,94 @@ def _main():
                         default=get_default_database_path(),
                         help='default: %(default)s')
     parser.add_argument('--accounting',
-                        default=os.path.join(os.environ['SGE_ROOT'],
-                                             os.environ['SGE_CELL'],
-                                             'common/accounting'),
-                        help='default: %(default)s',
-                        type=argparse.FileType('r',
-                                               encoding='utf-8',
-                                               errors='ignore'))
+                        default=get_default_accounting_path(),
+                        help='default: %(default)s')
+    parser.add_argument('--no-rotated',
+                        action='store_true',
+                        help='Do not load rotated accounting files')
+    parser.add_argument('--batch-size',
+                        default=DEFAULT_BATCH_SIZE,
+                        type=int,
+                        help='Rows per INSERT batch (default: %(default)s)')
+    parser.add_argument('--processes',
+                        default=1,
+                        type=int,
+                        help='Parse uncompressed files with N processes ' +
+                        '(default: %(default)s)')
+    parser.add_argument('--checkpoint-rows',
+                        default=DEFAULT_CHECKPOINT_ROWS,
+                        type=int,
+                        help='Commit rows and file offset every N rows, ' +
+                        '0 to commit once at the end (default: %(default)s)')
+    parser.add_argument('--journal-mode',
+                        choices=['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY',
+                                 'WAL', 'OFF'],
+                        help='SQLite journal_mode PRAGMA')
+    parser.add_argument('--synchronous',
+                        choices=['OFF', 'NORMAL', 'FULL', 'EXTRA'],
+                        help='SQLite synchronous PRAGMA')
+    parser.add_argument('--cache-size',
+                        type=int,
+                        help='SQLite cache_size PRAGMA (pages, or KiB if '
+                        'negative)')
     options = parser.parse_args()
 
-    db = connect_database(options.database)
-    load_data(db, options.accounting)
+    db = connect_database(options.database,
+                          journal_mode=options.journal_mode,
+                          synchronous=options.synchronous,
+                          cache_size=options.cache_size)
+    load_accounting_files(db,
+                          options.accounting,
+                          rotated=not options.no_rotated,
+                          batch_size=options.batch_size,
+                          checkpoint_rows=options.checkpoint_rows,
+                          processes=options.processes)
 
     for one in get_recent_data(db, days=7, hours=0):
-        cpu_time = one['ru_utime'] + one['ru_stime']
-        wallclock = one['ru_wallclock']
-        expected_cpu_time = wallclock * one['slots']
-        cpu_efficiency = cpu_time / expected_cpu_time
-        memory_efficiency = int(
-            one['maxvmem']) / (get_mem_req(one['category']) * one['slots'])
-
-        print(
-            one['job_number'], one['job_name'], one['slots'],
-            human_memory_display(get_mem_req(one['category']) * one['slots']),
-            human_memory_display(int(one['maxvmem'])),
-            '{:.3f}'.format(memory_efficiency),
-            '{:.3f}'.format(cpu_efficiency))
+        print(one['job_number'], one['job_name'], one['slots'],
+              human_memory_display(one['total_mem_req']),
+              human_memory_display(one['maxvmem_bytes']),
+              '{:.3f}'.format(one['memory_use_percent'] / 100),
+              '{:.3f}'.format(one['cpu_use_percent'] / 100))
 
 
 def get_default_database_path() -> str:
     return os.path.expanduser('~/.local/var/grid/accounting.sqlite3')
 
 
-def connect_database(dbpath: str) -> sqlite3.Connection:
+def get_default_accounting_path() -> str:
+    return os.path.join(os.environ['SGE_ROOT'], os.environ['SGE_CELL'],
+                        'common/accounting')
+
+
+def connect_database(dbpath: str,
+                     journal_mode: typing.Optional[str] = None,
+                     synchronous: typing.Optional[str] = None,
+                     cache_size: typing.Optional[int] = None
+                     ) -> sqlite3.Connection:
     if not os.path.isdir(os.path.dirname(dbpath)):
         os.makedirs(os.path.dirname(dbpath))
 
     db = sqlite3.connect(dbpath)
     db.row_factory = sqlite3.Row
+    # PRAGMA does not accept bound parameters; values are validated here
+    if journal_mode:
+        if not re.fullmatch(r'[A-Za-z]+', journal_mode):
+            raise Exception('invalid journal_mode: {}'.format(journal_mode))
+        db.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    if synchronous:
+        if not re.fullmatch(r'[A-Za-z0-3]+', synchronous):
+            raise Exception('invalid synchronous: {}'.format(synchronous))
+        db.execute('PRAGMA synchronous = {}'.format(synchronous))
+    if cache_size is not None:
+        db.execute('PRAGMA cache_size = {:d}'.format(cache_size))
     return db
 
 
 MEM_REQ = re.compile(r'mem_req=([\d.]+)([GMk]?)')
 
 
+@functools.lru_cache(maxsize=4096)
 def get_mem_req(category: str) -> int:
     matches = MEM_REQ.search(category)
     if not matches:
@@ -141,6 +225,7 @@ def get_mem_req(category: str) -> int:
 S_VMEM = re.compile(r's_vmem=([\d.]+)([GMk]?)')
 
 
+@functools.lru_cache(maxsize=4096)
 def get_svmem(category: str) -> int:
     matches = S_VMEM.search(category)
     if not matches:
@@ -158,6 +243,7 @@ def get_svmem(category: str) -> int:
     raise Exception('invalid mem_req: {}'.format(category))
 
 
+@functools.lru_cache(maxsize=4096)
 def human_memory_display(mem: int) -> str:
     if mem > 1024 * 1024 * 1024:
         return "{:.2f}G".format(mem / (1024 * 1024 * 1024))
@@ -168,158 +254,1334 @@ def human_memory_display(mem: int) -> str:
     return str(mem)
 
 
+RECORD_ORDER = {
+    'job': 'job_number, task_number',
+    'end': 'end_time',
+    'cpu': 'cpu_use_percent',
+    'memory': 'memory_use_percent',
+}
+
+
 def get_recent_data(db: sqlite3.Connection,
                     owner: str = None,
                     days: int = 7,
                     hours: int = 0,
                     succeeded_only: bool = False,
-                    failed_only: bool = False) -> typing.Iterator[sqlite3.Row]:
+                    failed_only: bool = False,
+                    min_cpu_use: typing.Optional[float] = None,
+                    max_cpu_use: typing.Optional[float] = None,
+                    min_memory_use: typing.Optional[float] = None,
+                    max_memory_use: typing.Optional[float] = None,
+                    order_by: str = 'job',
+                    columns: typing.Optional[typing.Sequence[str]] = None,
+                    since: typing.Optional[datetime.datetime] = None,
+                    until: typing.Optional[datetime.datetime] = None
+                    ) -> typing.Iterator[sqlite3.Row]:
+    # with columns, rows hold only those and add_info_to_record
+    # cannot re-derive missing values
     if not owner:
         owner = getpass.getuser()
 
+    if since is None:
+        since = datetime.datetime.now() - datetime.timedelta(days=days,
+                                                             hours=hours)
+
+    conditions = ['end_time > ?']
+    params: typing.List[typing.Any] = [since.timestamp() * 1000]
+    if until is not None:
+        conditions.append('end_time <= ?')
+        params.append(until.timestamp() * 1000)
+    if owner != '*':
+        conditions.append('owner = ?')
+        params.append(owner)
+    if succeeded_only:
+        conditions.append('failed = 0 AND exit_status = 0')
+    elif failed_only:
+        conditions.append('(failed <> 0 OR exit_status <> 0)')
+    for column, operator, value in [
+        ('cpu_use_percent', '>=', min_cpu_use),
+        ('cpu_use_percent', '<=', max_cpu_use),
+        ('memory_use_percent', '>=', min_memory_use),
+        ('memory_use_percent', '<=', max_memory_use),
+    ]:
+        if value is not None:
+            conditions.append('{} {} ?'.format(column, operator))
+            params.append(value)
+
+    sql = 'SELECT {} FROM accounting WHERE {} ORDER BY {}'.format(
+        select_columns(columns), ' AND '.join(conditions),
+        RECORD_ORDER[order_by])
+    return db.execute(sql, params)
+
+
+def get_job_records(db: sqlite3.Connection,
+                    job_number: int,
+                    task_number: typing.Optional[int] = None,
+                    columns: typing.Optional[typing.Sequence[str]] = None
+                    ) -> typing.Iterator[sqlite3.Row]:
+    sql = 'SELECT {} FROM accounting WHERE job_number = ?'.format(
+        select_columns(columns))
+    params = [job_number]
+    if task_number is not None:
+        sql += ' AND task_number = ?'
+        params.append(task_number)
+    return db.execute(sql, params)
+
+
+ACCOUNTING_COLUMNS = set(x[0] for x in ACCOUNTING_ITEMS + DERIVED_ITEMS)
+
+
+def select_columns(columns: typing.Optional[typing.Sequence[str]]) -> str:
+    if columns is None:
+        return '*'
+    for one in columns:
+        if one not in ACCOUNTING_COLUMNS:
+            raise Exception('Unknown accounting column: {}'.format(one))
+    return ','.join('"{}"'.format(x) for x in columns)
+
+
+# Cromwell names jobs cromwell_<first 8 chars of workflow ID>_<call name>
+JOB_GROUP_SQL = "CASE WHEN job_name GLOB 'cromwell_????????_*' " + \
+    "THEN substr(job_name, 19) ELSE job_name END"
+
+SUMMARY_GROUPS = {
+    'owner': 'owner',
+    'job': JOB_GROUP_SQL,
+    'queue': 'qname',
+    'day': "date(end_time / 1000, 'unixepoch', 'localtime')",
+}
+
+# columns read by get_summary; indexed together so it never reads the table
+SUMMARY_COLUMNS = [
+    'end_time', 'owner', 'qname', 'job_name', 'slots', 'ru_wallclock',
+    'cpu_time', 'expected_cpu_time', 'maxvmem_bytes', 'total_mem_req',
+    'failed', 'exit_status'
+]
+
+
+def get_summary(db: sqlite3.Connection,
+                group_by: typing.Sequence[str],
+                owner: str = '*',
+                days: int = 30,
+                hours: int = 0) -> typing.Iterator[sqlite3.Row]:
     begin_date = datetime.datetime.now() - datetime.timedelta(days=days,
                                                               hours=hours)
+    keys = [SUMMARY_GROUPS[x] for x in group_by]
+    # indexes are created by loading; a database that was never loaded
+    # gets a plain table scan
+    has_index = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' "
+        "AND name = 'accounting__summary'").fetchone() is not None
 
-    if owner == '*':
-        sql = (
-            'SELECT * FROM accounting WHERE end_time > ? {} ' +
-            'ORDER BY job_number, task_number'
-        ).format('AND failed = 0 AND exit_status = 0' if succeeded_only else (
-            'AND (failed <> 0 OR exit_status <> 0)' if failed_only else ''))
-        cur = db.execute(sql, (begin_date.timestamp() * 1000, ))
-    else:
-        sql = (
-            'SELECT * FROM accounting WHERE end_time > ? AND owner = ?' +
-            ' {} ORDER BY job_number, task_number'
-        ).format('AND failed = 0 AND exit_status = 0' if succeeded_only else (
-            'AND (failed <> 0 OR exit_status <> 0)' if failed_only else ''))
-        cur = db.execute(sql, (begin_date.timestamp() * 1000, owner))
-    return cur
+    conditions = ['end_time > ?']
+    params: typing.List[typing.Any] = [begin_date.timestamp() * 1000]
+    if owner != '*':
+        conditions.append('owner = ?')
+        params.append(owner)
 
+    sql = ('SELECT {keys}, COUNT(*) AS jobs, '
+           'SUM(failed <> 0 OR exit_status <> 0) AS failures, '
+           'SUM(ru_wallclock * slots) / 3600.0 AS slot_hours, '
+           'SUM(expected_cpu_time - cpu_time) / 3600.0 AS idle_slot_hours, '
+           'SUM(cpu_time) * 100.0 / SUM(expected_cpu_time) '
+           'AS cpu_use_percent, '
+           'SUM(maxvmem_bytes) * 100.0 / SUM(total_mem_req) '
+           'AS memory_use_percent '
+           'FROM accounting {hint} '
+           'WHERE {conditions} '
+           'GROUP BY {keys} ORDER BY slot_hours DESC').format(
+               keys=', '.join(keys), conditions=' AND '.join(conditions),
+               # without statistics the planner prefers
+               # accounting__owner__end_time for GROUP BY
+               hint='INDEXED BY accounting__summary' if has_index else '')
+    return db.execute(sql, params)
 
-def add_info_to_record(one: dict) -> dict:
-    one['cpu_time'] = one['ru_utime'] + one['ru_stime']
-    wallclock = one['ru_wallclock']
-    one['expected_cpu_time'] = wallclock * one['slots']
-    if one['expected_cpu_time'] > 0:
-        one['cpu_use%'] = one['cpu_time'] / one['expected_cpu_time'] * 100
-    else:
-        one['cpu_use%'] = 100.0
-    one['mem_req'] = get_mem_req(one['category'])
-    one['total_mem_req'] = one['mem_req'] * one['slots']
-    one['s_vmem'] = get_svmem(one['category'])
-    one['total_s_vmem'] = one['s_vmem'] * one['slots']
-    one['memory_use%'] = int(
-        one['maxvmem']) / (one['mem_req'] * one['slots']) * 100
-
-    job_id = str(one['job_number'])
-    if one['task_number'] > 0:
-        job_id += "." + str(one['task_number'])
-    one['job_id'] = job_id
 
-    return one
+RECOMMEND_GROUPS = {
+    'task': JOB_GROUP_SQL,
+    'name': 'job_name',
+}
 
+# requests are rounded up to a multiple of this
+MEM_REQ_STEP = 256 * 1024 * 1024
 
-def load_data(db: sqlite3.Connection, accounting: typing.TextIO):
-    db.execute('CREATE TABLE IF NOT EXISTS accounting(' +
-               ','.join(['"{}" {}'.format(*x)
-                         for x in ACCOUNTING_ITEMS]) + ')')
-    db.execute(
-        'CREATE TABLE IF NOT EXISTS processed_bytes(processed_bytes INTEGER)')
 
-    count = 0
+class Recommendation(typing.NamedTuple):
+    name: str
+    jobs: int
+    slots: int
+    mem_req: int
+    s_vmem: int
+    maxvmem: int
+    cpu_parallelism: float
+    wallclock: float
+    recommended_slots: int
+    recommended_mem_req: int
+    reserved_gb_hours: float
+    recommended_gb_hours: float
+
+
+def _percentile_rank(percentile: float) -> str:
+    # nearest-rank method: ceil(n * p / 100), at least 1
+    rank = 'jobs * {} / 100.0'.format(float(percentile))
+    return 'MAX(1, CAST({0} AS INTEGER) + ({0} > CAST({0} AS INTEGER)))' \
+        .format(rank)
+
+
+# ROW_NUMBER() and COUNT() OVER need SQLite 3.25; older versions, as
+# linked by the Python of e.g. CentOS 7, sort each group in Python
+WINDOW_FUNCTIONS = sqlite3.sqlite_version_info >= (3, 25, 0)
+
+
+def _percentile_rows_sql(db: sqlite3.Connection, key: str,
+                         conditions: typing.List[str],
+                         params: typing.List[typing.Any], percentile: float,
+                         min_jobs: int) -> typing.Iterable[tuple]:
+    sql = ('WITH ranked AS (SELECT {key} AS name, slots, mem_req, s_vmem, '
+           'total_mem_req, ru_wallclock, maxvmem_bytes, '
+           'cpu_time / MAX(ru_wallclock, 1) AS cpu_parallelism, '
+           'COUNT(*) OVER (PARTITION BY {key}) AS jobs, '
+           'ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY maxvmem_bytes) '
+           'AS memory_rank, '
+           'ROW_NUMBER() OVER (PARTITION BY {key} '
+           'ORDER BY cpu_time / MAX(ru_wallclock, 1)) AS cpu_rank, '
+           'ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY ru_wallclock) '
+           'AS wallclock_rank '
+           'FROM accounting WHERE {conditions}) '
+           'SELECT name, jobs, MAX(slots), MAX(mem_req), MAX(s_vmem), '
+           'MAX(CASE WHEN memory_rank = {rank} THEN maxvmem_bytes END), '
+           'MAX(CASE WHEN cpu_rank = {rank} THEN cpu_parallelism END), '
+           'MAX(CASE WHEN wallclock_rank = {rank} THEN ru_wallclock END), '
+           'SUM(total_mem_req * ru_wallclock), SUM(ru_wallclock) '
+           'FROM ranked WHERE jobs >= ? GROUP BY name').format(
+               key=key,
+               conditions=' AND '.join(conditions),
+               rank=_percentile_rank(percentile))
+    return db.execute(sql, params + [min_jobs])
+
+
+def _percentile_rows_python(db: sqlite3.Connection, key: str,
+                            conditions: typing.List[str],
+                            params: typing.List[typing.Any],
+                            percentile: float,
+                            min_jobs: int) -> typing.Iterator[tuple]:
+    # same rows as _percentile_rows_sql, one group in memory at a time
+    sql = ('SELECT {key} AS name, slots, mem_req, s_vmem, '
+           'total_mem_req * ru_wallclock, ru_wallclock, maxvmem_bytes, '
+           'cpu_time / MAX(ru_wallclock, 1) '
+           'FROM accounting WHERE {conditions} ORDER BY name').format(
+               key=key, conditions=' AND '.join(conditions))
 
-    data = [
-        x for x in db.execute('SELECT processed_bytes FROM processed_bytes')
+    def at_rank(values: typing.List[typing.Any], rank: int) -> typing.Any:
+        # NULLs sort first in SQLite
+        return sorted(values, key=lambda x: (x is not None, x))[rank - 1]
+
+    def maximum(values: typing.Iterable[typing.Any]) -> typing.Any:
+        return max((x for x in values if x is not None), default=None)
+
+    def total(values: typing.Iterable[typing.Any]) -> typing.Any:
+        values = [x for x in values if x is not None]
+        return sum(values) if values else None
+
+    for name, group in itertools.groupby(db.execute(sql, params),
+                                         key=lambda x: x[0]):
+        rows = list(group)
+        jobs = len(rows)
+        if jobs < min_jobs:
+            continue
+        rank = max(1, math.ceil(jobs * percentile / 100.0))
+        columns = list(zip(*rows))
+        yield (name, jobs, maximum(columns[1]), maximum(columns[2]),
+               maximum(columns[3]), at_rank(columns[6], rank),
+               at_rank(columns[7], rank), at_rank(columns[5], rank),
+               total(columns[4]), total(columns[5]))
+
+
+def get_recommendations(db: sqlite3.Connection,
+                        group_by: str = 'task',
+                        owner: str = '*',
+                        days: int = 90,
+                        hours: int = 0,
+                        percentile: float = 95,
+                        margin: float = 1.2,
+                        min_jobs: int = 1) -> typing.List[Recommendation]:
+    # percentiles are over the whole history; memory gets margin head
+    # room, is split over the slots and rounded up to MEM_REQ_STEP
+    if not 0 < percentile <= 100:
+        raise Exception('Invalid percentile: {}'.format(percentile))
+    begin_date = datetime.datetime.now() - datetime.timedelta(days=days,
+                                                              hours=hours)
+    conditions = [
+        'end_time > ?', 'failed = 0', 'exit_status = 0',
+        'maxvmem_bytes IS NOT NULL'
     ]
-    if data:
-        accounting.seek(data[0][0])
+    params: typing.List[typing.Any] = [begin_date.timestamp() * 1000]
+    if owner != '*':
+        conditions.append('owner = ?')
+        params.append(owner)
+    if WINDOW_FUNCTIONS:
+        rows = _percentile_rows_sql(db, RECOMMEND_GROUPS[group_by],
+                                    conditions, params, percentile, min_jobs)
+    else:
+        rows = _percentile_rows_python(db, RECOMMEND_GROUPS[group_by],
+                                       conditions, params, percentile,
+                                       min_jobs)
+
+    gb_hours = 1024 * 1024 * 1024 * 3600
+    results = []
+    for (name, jobs, slots, mem_req, s_vmem, maxvmem, cpu_parallelism,
+         wallclock, reserved, total_wallclock) in rows:
+        recommended_slots = max(1, math.ceil(cpu_parallelism))
+        steps = math.ceil(maxvmem * margin / recommended_slots / MEM_REQ_STEP)
+        recommended_mem_req = max(1, steps) * MEM_REQ_STEP
+        results.append(
+            Recommendation(
+                name, jobs, slots, mem_req, s_vmem, maxvmem, cpu_parallelism,
+                wallclock, recommended_slots, recommended_mem_req,
+                reserved / gb_hours, recommended_slots * recommended_mem_req *
+                total_wallclock / gb_hours))
+    results.sort(key=lambda x: x.reserved_gb_hours - x.recommended_gb_hours,
+                 reverse=True)
+    return results
+
+
+EXPORT_FORMATS = ['parquet', 'arrow', 'csv']
+EXPORT_SUFFIX = {
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.csv': 'csv',
+}
+EXPORT_TIME_COLUMNS = {'submission_time', 'start_time', 'end_time'}
+DEFAULT_EXPORT_ROWS = 100000
+
+
+def export_format(path: str) -> str:
+    return EXPORT_SUFFIX.get(os.path.splitext(path)[1].lower(), 'csv')
 
+
+def export_records(db: sqlite3.Connection,
+                   output_path: str,
+                   format: typing.Optional[str] = None,
+                   owner: str = '*',
+                   since: typing.Optional[datetime.datetime] = None,
+                   until: typing.Optional[datetime.datetime] = None,
+                   chunk_rows: int = DEFAULT_EXPORT_ROWS) -> int:
+    # chunk_rows rows are written at a time, so memory use does not
+    # depend on the number of rows; output_path is replaced when done
+    if format is None:
+        format = export_format(output_path)
+    if format not in EXPORT_FORMATS:
+        raise Exception('Unknown export format: {}'.format(format))
+
+    if since is None:
+        since = datetime.datetime.fromtimestamp(0)
+    items = ACCOUNTING_ITEMS + DERIVED_ITEMS
+    cursor = get_recent_data(db,
+                             owner=owner,
+                             order_by='end',
+                             columns=[x[0] for x in items],
+                             since=since,
+                             until=until)
+
+    if output_path == '-':
+        if format != 'csv':
+            raise Exception('Only CSV can be written to stdout')
+        return _export_csv(cursor, sys.stdout, items, chunk_rows)
+
+    temp_path = '{}.{}.tmp'.format(output_path, os.getpid())
+    try:
+        if format == 'csv':
+            with open(temp_path, 'w', newline='') as f:
+                count = _export_csv(cursor, f, items, chunk_rows)
+        else:
+            count = _export_arrow(cursor, temp_path, format, items,
+                                  chunk_rows)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return count
+
+
+def _export_csv(cursor: sqlite3.Cursor, output: typing.TextIO,
+                items: typing.List[typing.Tuple[str, str]],
+                chunk_rows: int) -> int:
+    writer = csv.writer(output)
+    writer.writerow([x[0] for x in items])
+    count = 0
     while True:
-        line = accounting.readline()
-        if not line:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
             break
-        if line[0] == '#':
-            continue
-        row = line.strip().split(':')
-        row_data = {x[0]: y for (x, y) in zip(ACCOUNTING_ITEMS, row)}
-        db.execute(
-            'INSERT INTO accounting(' +
-            ','.join(['"{}"'.format(x) for x in row_data]) + ') VALUES (' +
-            ','.join(['?' for x in row_data]) + ')',
-            [x for x in row_data.values()])
+        writer.writerows(rows)
+        count += len(rows)
+        print('Exported {} rows'.format(count), file=sys.stderr)
+    return count
+
+
+def _export_arrow(cursor: sqlite3.Cursor, path: str, format: str,
+                  items: typing.List[typing.Tuple[str, str]],
+                  chunk_rows: int) -> int:
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception(
+            '{} export requires pyarrow; install cromwell-helper[export] '
+            'or export as CSV'.format(format))
+
+    sql_types = {
+        'INTEGER': pyarrow.int64(),
+        'REAL': pyarrow.float64(),
+        'TEXT': pyarrow.string(),
+    }
+    schema = pyarrow.schema([
+        (name, pyarrow.timestamp('ms')
+         if name in EXPORT_TIME_COLUMNS else sql_types[sql_type])
+        for name, sql_type in items
+    ])
+    python_types = {
+        'INTEGER': int,
+        'REAL': (int, float),
+        'TEXT': str,
+    }
 
-        count += 1
-        if (count % 10000) == 0:
-            print("Processing {} entries".format(count), file=sys.stderr)
+    def to_array(values: tuple, field, sql_type: str):
+        try:
+            return pyarrow.array(values, type=field.type)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # SQLite keeps values that do not fit the declared column type
+            return pyarrow.array(
+                [x if isinstance(x, python_types[sql_type]) else None
+                 for x in values],
+                type=field.type)
 
-    db.execute('DELETE from processed_bytes')
-    db.execute('INSERT INTO processed_bytes(processed_bytes) VALUES(?)',
-               [accounting.tell()])
+    if format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(path, schema)
+    else:
+        writer = pyarrow.ipc.new_file(path, schema)
+
+    count = 0
+    with writer:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            columns = [
+                to_array(values, field, item[1])
+                for values, field, item in zip(zip(*rows), schema, items)
+            ]
+            # one row group or record batch per chunk
+            writer.write_table(pyarrow.Table.from_arrays(columns,
+                                                         schema=schema))
+            count += len(rows)
+            print('Exported {} rows'.format(count), file=sys.stderr)
+    return count
+
+
+def derive_values(job_number, task_number, ru_wallclock, ru_utime, ru_stime,
+                  slots, category, maxvmem) -> typing.List[typing.Any]:
+    try:
+        slots = int(slots)
+        task_number = int(task_number)
+        wallclock = float(ru_wallclock)
+        cpu_time = float(ru_utime) + float(ru_stime)
+        maxvmem = int(float(maxvmem))
+    except (TypeError, ValueError):
+        return [None] * len(DERIVED_ITEMS)
+
+    job_id = str(job_number)
+    if task_number > 0:
+        job_id += "." + str(task_number)
+
+    expected_cpu_time = wallclock * slots
+    if expected_cpu_time > 0:
+        cpu_use = cpu_time / expected_cpu_time * 100
+    else:
+        cpu_use = 100.0
+    mem_req = get_mem_req(category or '')
+    s_vmem = get_svmem(category or '')
+    if mem_req * slots > 0:
+        memory_use: typing.Optional[float] = maxvmem / (mem_req * slots) * 100
+    else:
+        memory_use = None
+
+    return [
+        job_id, cpu_time, expected_cpu_time, cpu_use, mem_req,
+        mem_req * slots, s_vmem, s_vmem * slots, maxvmem, memory_use
+    ]
+
+
+def add_info_to_record(one: dict) -> dict:
+    if one.get('cpu_use_percent') is None and \
+       all(x in one for x in DERIVED_SOURCE):
+        # not derived at load time
+        one.update(
+            zip([x[0] for x in DERIVED_ITEMS],
+                derive_values(*[one[x] for x in DERIVED_SOURCE])))
+
+    if 'cpu_use_percent' in one:
+        one['cpu_use%'] = one.pop('cpu_use_percent')
+    if 'memory_use_percent' in one:
+        one['memory_use%'] = one.pop('memory_use_percent')
+    maxvmem = one.pop('maxvmem_bytes', None)
+    if maxvmem is not None:
+        one['maxvmem'] = maxvmem
+
+    return one
 
+
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_CHECKPOINT_ROWS = 100000
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+
+INSERT_ACCOUNTING_SQL = (
+    'INSERT INTO accounting(' +
+    ','.join(['"{}"'.format(x[0])
+              for x in ACCOUNTING_ITEMS + DERIVED_ITEMS]) + ') VALUES (' +
+    ','.join(['?' for x in ACCOUNTING_ITEMS + DERIVED_ITEMS]) + ')')
+
+DERIVED_SOURCE_INDEX = [ACCOUNTING_INDEX[x] for x in DERIVED_SOURCE]
+
+
+class Progress(typing.NamedTuple):
+    processed_bytes: int
+    inode: typing.Optional[int]
+    size: typing.Optional[int]
+    completed: bool = False
+
+
+def parse_accounting_line(
+        line: str) -> typing.Optional[typing.List[typing.Any]]:
+    if not line or line[0] == '#':
+        return None
+    row: typing.List[typing.Any] = line.strip().split(':')
+    if len(row) >= len(ACCOUNTING_ITEMS):
+        row = row[:len(ACCOUNTING_ITEMS)]
+    else:
+        # older accounting formats have fewer columns; missing ones are NULL
+        row += [None] * (len(ACCOUNTING_ITEMS) - len(row))
+    return row + derive_values(*[row[x] for x in DERIVED_SOURCE_INDEX])
+
+
+def create_tables(db: sqlite3.Connection):
+    if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' " +
+                  "AND name = 'accounting'").fetchone():
+        migrate_schema(db)
+    else:
+        db.execute('CREATE TABLE accounting(' +
+                   ','.join(['"{}" {}'.format(*x)
+                             for x in ACCOUNTING_ITEMS + DERIVED_ITEMS]) +
+                   ')')
+        db.execute('PRAGMA user_version = {:d}'.format(SCHEMA_VERSION))
+    db.execute('CREATE TABLE IF NOT EXISTS accounting_files(' +
+               'fingerprint TEXT PRIMARY KEY, path TEXT, ' +
+               'processed_bytes INTEGER, inode INTEGER, size INTEGER, ' +
+               'completed INTEGER)')
+    db.execute('CREATE TABLE IF NOT EXISTS sync_state(' +
+               'key TEXT PRIMARY KEY, value)')
+
+
+# milliseconds to wait for another process migrating the same database
+MIGRATION_BUSY_TIMEOUT = 30 * 60 * 1000
+
+
+def migrate_schema(db: sqlite3.Connection):
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    db.commit()
+    # take the write lock before reading anything, so that a concurrent
+    # migration makes us wait instead of failing at upgrade time
+    busy_timeout = db.execute('PRAGMA busy_timeout').fetchone()[0]
+    db.execute('PRAGMA busy_timeout = {:d}'.format(MIGRATION_BUSY_TIMEOUT))
+    try:
+        db.execute('BEGIN IMMEDIATE')
+    finally:
+        db.execute('PRAGMA busy_timeout = {:d}'.format(busy_timeout))
+    try:
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            # migrated by another process while we were waiting
+            db.rollback()
+            return
+
+        print('Upgrading accounting database', file=sys.stderr)
+        # version 1: derived columns
+        columns = {x[1] for x in db.execute('PRAGMA table_info(accounting)')}
+        for name, sql_type in DERIVED_ITEMS:
+            if name not in columns:
+                db.execute('ALTER TABLE accounting ADD COLUMN "{}" {}'.format(
+                    name, sql_type))
+
+        update_sql = 'UPDATE accounting SET {} WHERE rowid = ?'.format(
+            ','.join(['"{}" = ?'.format(x[0]) for x in DERIVED_ITEMS]))
+        select_sql = 'SELECT rowid, {} FROM accounting WHERE rowid > ? ' \
+            'ORDER BY rowid LIMIT ?'.format(','.join(
+                ['"{}"'.format(x) for x in DERIVED_SOURCE]))
+        last_rowid = 0
+        while True:
+            rows = db.execute(select_sql,
+                              (last_rowid, DEFAULT_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            db.executemany(update_sql,
+                           [derive_values(*x[1:]) + [x[0]] for x in rows])
+            last_rowid = rows[-1][0]
+
+        db.execute('PRAGMA user_version = {:d}'.format(SCHEMA_VERSION))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+
+# indexes matching the filters of get_recent_data; named after their columns
+RECORD_INDEXES = [['owner', 'end_time'], ['end_time', 'failed', 'exit_status']]
+
+
+def create_indexes(db: sqlite3.Connection):
     for one in [
-            'owner', 'job_number', 'submission_time', 'start_time', 'end_time'
+            'job_number', 'submission_time', 'start_time', 'cpu_use_percent',
+            'memory_use_percent'
     ]:
         db.execute(
             'CREATE INDEX IF NOT EXISTS accounting__{0} ON accounting({0})'.
             format(one))
+    for one in RECORD_INDEXES:
+        db.execute('CREATE INDEX IF NOT EXISTS accounting__{} '.format(
+            '__'.join(one)) + 'ON accounting({})'.format(','.join(one)))
+    # prefixes of the indexes above; keeping them only slows down loading
+    db.execute('DROP INDEX IF EXISTS accounting__owner')
+    db.execute('DROP INDEX IF EXISTS accounting__end_time')
+    db.execute('CREATE INDEX IF NOT EXISTS accounting__summary ' +
+               'ON accounting({})'.format(','.join(
+                   ['"{}"'.format(x) for x in SUMMARY_COLUMNS])))
+
+
+ROTATED_SUFFIX = re.compile(r'[.\-](\d+)(\.gz|\.bz2|\.xz)?$')
+
+
+def find_accounting_files(accounting_path: str) -> typing.List[str]:
+    # rotated files oldest first, then the live file
+    dirname = os.path.dirname(os.path.abspath(accounting_path))
+    basename = os.path.basename(accounting_path)
 
+    rotated = []
+    for one in os.listdir(dirname):
+        if not one.startswith(basename):
+            continue
+        matches = ROTATED_SUFFIX.fullmatch(one[len(basename):])
+        if not matches:
+            continue
+        one_path = os.path.join(dirname, one)
+        # logrotate numbers newer files lower; dateext numbers them higher
+        number = int(matches.group(1))
+        if len(matches.group(1)) < 8:
+            number = -number
+        rotated.append((os.stat(one_path).st_mtime, number, one_path))
+    rotated.sort()
+
+    files = [x[2] for x in rotated]
+    if os.path.exists(accounting_path):
+        files.append(accounting_path)
+    return files
+
+
+def open_accounting(path: str) -> typing.TextIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='ignore')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8', errors='ignore')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rt', encoding='utf-8', errors='ignore')
+    return open(path, encoding='utf-8', errors='ignore')
+
+
+def accounting_fingerprint(
+        accounting: typing.TextIO
+) -> typing.Tuple[typing.Optional[str], typing.Optional[typing.List[str]]]:
+    # a rotated file starts with the same line as the live file it
+    # was rotated from, so progress carries over between them
+    accounting.seek(0)
+    try:
+        while True:
+            line = accounting.readline()
+            if not line or not line.endswith('\n'):
+                return (None, None)
+            row = parse_accounting_line(line)
+            if row is not None:
+                return (hashlib.sha1(line.encode('utf-8')).hexdigest(), row)
+    finally:
+        accounting.seek(0)
+
+
+def file_identity(
+        accounting: typing.IO
+) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    try:
+        stat_result = os.fstat(accounting.fileno())
+    except (OSError, ValueError):
+        # in-memory streams have no file descriptor
+        return (None, None)
+    return (stat_result.st_ino, stat_result.st_size)
+
+
+def get_progress(db: sqlite3.Connection,
+                 fingerprint: str) -> typing.Optional[Progress]:
+    data = db.execute(
+        'SELECT processed_bytes, inode, size, completed ' +
+        'FROM accounting_files WHERE fingerprint = ?',
+        (fingerprint, )).fetchone()
+    if not data:
+        return None
+    return Progress(data[0], data[1], data[2], bool(data[3]))
+
+
+def save_progress(db: sqlite3.Connection, fingerprint: str,
+                  path: typing.Optional[str], progress: Progress):
+    db.execute(
+        'INSERT OR REPLACE INTO accounting_files(fingerprint, path, ' +
+        'processed_bytes, inode, size, completed) VALUES(?, ?, ?, ?, ?, ?)',
+        (fingerprint, path) + tuple(progress))
+
+
+def is_completed_file(db: sqlite3.Connection, path: str) -> bool:
+    create_tables(db)
+    stat_result = os.stat(path)
+    data = db.execute(
+        'SELECT 1 FROM accounting_files WHERE inode = ? AND size = ? ' +
+        'AND completed <> 0', (stat_result.st_ino, stat_result.st_size)
+    ).fetchone()
+    return data is not None
+
+
+def legacy_progress(db: sqlite3.Connection,
+                    first_row: typing.List[str]) -> typing.Optional[Progress]:
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' " +
+                      "AND name = 'processed_bytes'").fetchone():
+        return None
+    data = db.execute('SELECT * FROM processed_bytes').fetchone()
+    if not data:
+        return None
+    # the old loader read only one file, whose first row is in the table
+    loaded = db.execute(
+        'SELECT 1 FROM accounting WHERE job_number = ? AND ' +
+        'task_number = ? AND end_time = ? LIMIT 1',
+        [first_row[ACCOUNTING_INDEX[x]]
+         for x in ('job_number', 'task_number', 'end_time')]).fetchone()
+    if not loaded:
+        return None
+    return Progress(data[0], None, None)
+
+
+def resume_position(progress: typing.Optional[Progress],
+                    size: typing.Optional[int]) -> int:
+    if progress is None:
+        return 0
+    if size is not None and progress.size is not None and \
+       (size < progress.processed_bytes or size < progress.size):
+        print('accounting file was truncated; loading from the beginning',
+              file=sys.stderr)
+        return 0
+    return progress.processed_bytes
+
+
+def is_compressed(path: typing.Optional[str]) -> bool:
+    return path is not None and path.endswith(('.gz', '.bz2', '.xz'))
+
+
+def start_load(
+        db: sqlite3.Connection, accounting: typing.TextIO,
+        path: typing.Optional[str]
+) -> typing.Optional[typing.Tuple[str, typing.Optional[int], int]]:
+    # returns (fingerprint, inode, offset) to resume from, or None
+    create_tables(db)
     db.commit()
 
+    fingerprint, first_row = accounting_fingerprint(accounting)
+    if fingerprint is None or first_row is None:
+        return None
+
+    inode, size = file_identity(accounting)
+    if is_compressed(path):
+        # offsets are in decompressed bytes; the file size does not compare
+        size = None
+    progress = get_progress(db, fingerprint)
+    if progress is None:
+        progress = legacy_progress(db, first_row)
+        if progress is not None:
+            db.execute('BEGIN')
+            db.execute('DROP TABLE processed_bytes')
+            save_progress(db, fingerprint, path, progress)
+            db.commit()
+    if progress is not None and progress.completed:
+        return None
+    return (fingerprint, inode, resume_position(progress, size))
+
+
+def load_data(db: sqlite3.Connection,
+              accounting: typing.TextIO,
+              batch_size: int = DEFAULT_BATCH_SIZE,
+              checkpoint_rows: int = DEFAULT_CHECKPOINT_ROWS,
+              path: typing.Optional[str] = None,
+              completed: bool = False) -> int:
+    # rows and the byte offset are committed together every
+    # checkpoint_rows rows, so an interrupted load resumes from there
+    resume = start_load(db, accounting, path)
+    if resume is None:
+        return 0
+    fingerprint, inode, position = resume
+    accounting.seek(position)
+
+    count = 0
+    checkpointed = 0
 
-def qstat(args=[]):
-    result = subprocess.run(['qstat', '-xml', '-u', '*', '-r'],
-                            capture_output=True,
-                            check=True)
-    dom = xml.dom.minidom.parseString(result.stdout)
-
-    job_elements = dom.getElementsByTagName('job_list')
-    jobs = []
-    for one_job in job_elements:
-        new_one = {
-            'name':
-            one_job.getElementsByTagName('JB_name')[0].firstChild.data.strip(),
-            'job_id':
-            one_job.getElementsByTagName(
-                'JB_job_number')[0].firstChild.data.strip(),
-            'owner':
-            one_job.getElementsByTagName(
-                'JB_owner')[0].firstChild.data.strip(),
-            'state':
-            one_job.getElementsByTagName('state')[0].firstChild.data.strip(),
-            'slots':
-            one_job.getElementsByTagName('slots')[0].firstChild.data.strip(),
-            'priority':
-            one_job.getElementsByTagName('JAT_prio')
-            [0].firstChild.data.strip(),
-        }
-
-        if one_job.getElementsByTagName(
-                'queue_name') and one_job.getElementsByTagName(
-                    'queue_name')[0].firstChild:
-            new_one['queue_name'] = one_job.getElementsByTagName(
-                'queue_name')[0].firstChild.data.strip()
-        if one_job.getElementsByTagName(
-                'tasks') and one_job.getElementsByTagName(
-                    'tasks')[0].firstChild:
-            new_one['tasks'] = one_job.getElementsByTagName(
-                'tasks')[0].firstChild.data.strip()
-        if one_job.getElementsByTagName(
-                'JAT_start_time') and one_job.getElementsByTagName(
-                    'JAT_start_time')[0].firstChild:
-            new_one['start_time'] = datetime.datetime.strptime(
-                one_job.getElementsByTagName('JAT_start_time')
-                [0].firstChild.data.strip(), '%Y-%m-%dT%H:%M:%S.%f')
-        if one_job.getElementsByTagName(
-                'JB_submission_time') and one_job.getElementsByTagName(
-                    'JB_submission_time')[0].firstChild:
-            new_one['submission_time'] = datetime.datetime.strptime(
-                one_job.getElementsByTagName('JB_submission_time')
-                [0].firstChild.data.strip(), '%Y-%m-%dT%H:%M:%S.%f')
-
-        jobs.append(new_one)
+    def checkpoint(done: bool, offset: typing.Optional[int] = None):
+        if offset is None:
+            offset = accounting.tell()
+        save_progress(
+            db, fingerprint, path,
+            Progress(offset, inode, file_identity(accounting)[1], done))
+        db.commit()
+
+    db.execute('BEGIN')
+    try:
+        batch = []
+        partial_start = None
+        while True:
+            line = accounting.readline()
+            if not line:
+                break
+            if not line.endswith('\n'):
+                # a trailing line without newline may still be being
+                # written; resume from its start next time
+                end = accounting.tell()
+                if hasattr(accounting, 'buffer'):
+                    partial_start = last_line_end(accounting.buffer,
+                                                  position, end)
+                else:
+                    # in-memory text, offsets are in characters
+                    partial_start = end - len(line)
+                break
+            row = parse_accounting_line(line)
+            if row is None:
+                continue
+            batch.append(row)
+            checkpoint_due = checkpoint_rows > 0 and \
+                count + len(batch) - checkpointed >= checkpoint_rows
+            if len(batch) >= batch_size or checkpoint_due:
+                db.executemany(INSERT_ACCOUNTING_SQL, batch)
+                count += len(batch)
+                batch = []
+                print("Processing {} entries".format(count), file=sys.stderr)
+            if checkpoint_due:
+                checkpoint(False)
+                checkpointed = count
+                db.execute('BEGIN')
+        if batch:
+            db.executemany(INSERT_ACCOUNTING_SQL, batch)
+            count += len(batch)
+
+        create_indexes(db)
+        checkpoint(completed, partial_start)
+    except BaseException:
+        db.rollback()
+        raise
+
+    return count
+
+
+def last_line_end(accounting: typing.BinaryIO, start: int, end: int) -> int:
+    while end > start:
+        block_start = max(start, end - 65536)
+        accounting.seek(block_start)
+        newline = accounting.read(end - block_start).rfind(b'\n')
+        if newline >= 0:
+            return block_start + newline + 1
+        end = block_start
+    return start
+
+
+def split_ranges(accounting: typing.BinaryIO, start: int,
+                 chunk_bytes: int) -> typing.List[typing.Tuple[int, int]]:
+    accounting.seek(0, io.SEEK_END)
+    # a trailing line without newline may still be being written
+    end = last_line_end(accounting, start, accounting.tell())
+
+    ranges = []
+    begin = start
+    while begin < end:
+        if begin + chunk_bytes >= end:
+            boundary = end
+        else:
+            accounting.seek(begin + chunk_bytes)
+            accounting.readline()
+            boundary = min(accounting.tell(), end)
+        ranges.append((begin, boundary))
+        begin = boundary
+    return ranges
+
+
+def parse_accounting_range(
+        args: typing.Tuple[str, int, int]) -> typing.List[typing.List[str]]:
+    path, begin, end = args
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        data = f.read(end - begin).decode('utf-8', errors='ignore')
+    rows = []
+    for line in data.split('\n'):
+        row = parse_accounting_line(line)
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+def load_data_parallel(db: sqlite3.Connection,
+                       path: str,
+                       processes: typing.Optional[int] = None,
+                       chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                       checkpoint_rows: int = DEFAULT_CHECKPOINT_ROWS,
+                       completed: bool = False) -> int:
+    # workers parse ranges of whole lines; results are inserted in
+    # file order so that checkpoints stay valid offsets
+    with open_accounting(path) as f:
+        resume = start_load(db, f, path)
+    if resume is None:
+        return 0
+    fingerprint, inode, position = resume
+
+    with open(path, 'rb') as f:
+        ranges = split_ranges(f, position, chunk_bytes)
+    if not ranges:
+        return 0
+
+    count = 0
+    checkpointed = 0
+    start_time = time.perf_counter()
+
+    def report():
+        elapsed = time.perf_counter() - start_time
+        print('Processing {} entries ({:.0f} entries/s, {:.1f} MB/s)'.format(
+            count, count / elapsed,
+            (end - position) / elapsed / 1024 / 1024),
+              file=sys.stderr)
+
+    with multiprocessing.Pool(processes) as pool:
+        # keep a bounded number of parsed chunks in flight
+        max_pending = 2 * (processes or os.cpu_count() or 1)
+        pending: typing.Deque[typing.Tuple[int, typing.Any]] = \
+            collections.deque()
+        remaining = collections.deque(ranges)
+
+        db.execute('BEGIN')
+        try:
+            while remaining or pending:
+                while remaining and len(pending) < max_pending:
+                    range_begin, range_end = remaining.popleft()
+                    pending.append((range_end,
+                                    pool.apply_async(
+                                        parse_accounting_range,
+                                        ((path, range_begin, range_end), ))))
+                end, result = pending.popleft()
+                rows = result.get()
+                db.executemany(INSERT_ACCOUNTING_SQL, rows)
+                count += len(rows)
+                if checkpoint_rows > 0 and \
+                   count - checkpointed >= checkpoint_rows:
+                    save_progress(
+                        db, fingerprint, path,
+                        Progress(end, inode, os.stat(path).st_size, False))
+                    db.commit()
+                    checkpointed = count
+                    report()
+                    db.execute('BEGIN')
+
+            create_indexes(db)
+            save_progress(
+                db, fingerprint, path,
+                Progress(ranges[-1][1], inode, os.stat(path).st_size,
+                         completed))
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+
+    end = ranges[-1][1]
+    report()
+    return count
+
+
+def load_accounting_files(db: sqlite3.Connection,
+                          accounting_path: str,
+                          rotated: bool = True,
+                          batch_size: int = DEFAULT_BATCH_SIZE,
+                          checkpoint_rows: int = DEFAULT_CHECKPOINT_ROWS,
+                          processes: int = 1) -> int:
+    # files already read to the end are skipped without being opened
+    started = time.time()
+    if rotated:
+        files = find_accounting_files(accounting_path)
+    else:
+        files = [accounting_path]
+
+    count = 0
+    for one in files:
+        is_live = os.path.abspath(one) == os.path.abspath(accounting_path)
+        if not is_live and is_completed_file(db, one):
+            continue
+        if processes > 1 and not is_compressed(one):
+            loaded = load_data_parallel(db,
+                                        one,
+                                        processes=processes,
+                                        checkpoint_rows=checkpoint_rows,
+                                        completed=not is_live)
+        else:
+            with open_accounting(one) as f:
+                loaded = load_data(db,
+                                   f,
+                                   batch_size=batch_size,
+                                   checkpoint_rows=checkpoint_rows,
+                                   path=one,
+                                   completed=not is_live)
+        if loaded:
+            print('Loaded {} entries from {}'.format(loaded, one),
+                  file=sys.stderr)
+        count += loaded
+
+    set_last_sync(db, started)
+    db.commit()
+    return count
+
+
+def get_last_sync(db: sqlite3.Connection) -> typing.Optional[float]:
+    create_tables(db)
+    data = db.execute(
+        "SELECT value FROM sync_state WHERE key = 'last_sync'").fetchone()
+    if not data:
+        return None
+    return data[0]
+
+
+def set_last_sync(db: sqlite3.Connection, timestamp: float):
+    db.execute(
+        "INSERT OR REPLACE INTO sync_state(key, value) " +
+        "VALUES('last_sync', ?)", (timestamp, ))
+
+
+QSTAT_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class QstatJob(typing.NamedTuple):
+    # a job, or a task of an array job
+    name: str
+    job_id: str
+    owner: str
+    state: str
+    slots: str
+    priority: str
+    queue_name: typing.Optional[str] = None
+    tasks: typing.Optional[str] = None
+    start_time: typing.Optional[datetime.datetime] = None
+    submission_time: typing.Optional[datetime.datetime] = None
+
+
+def _qstat_time(text: typing.Optional[str]
+                ) -> typing.Optional[datetime.datetime]:
+    if not text:
+        return None
+    return datetime.datetime.strptime(text.strip(), QSTAT_TIME_FORMAT)
+
+
+def parse_qstat_xml(source: typing.BinaryIO) -> typing.Iterator[QstatJob]:
+    parents: typing.List[ElementTree.Element] = []
+    for event, element in ElementTree.iterparse(source,
+                                                events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag != 'job_list':
+            continue
+
+        # tasks of one job repeat the same strings; share them
+        queue_name = element.findtext('queue_name')
+        tasks = element.findtext('tasks')
+        new_one = QstatJob(
+            name=sys.intern(element.findtext('JB_name', '').strip()),
+            job_id=sys.intern(element.findtext('JB_job_number', '').strip()),
+            owner=sys.intern(element.findtext('JB_owner', '').strip()),
+            state=sys.intern(element.findtext('state', '').strip()),
+            slots=sys.intern(element.findtext('slots', '').strip()),
+            priority=sys.intern(element.findtext('JAT_prio', '').strip()),
+            queue_name=sys.intern(queue_name.strip()) if queue_name else None,
+            tasks=tasks.strip() if tasks else None,
+            start_time=_qstat_time(element.findtext('JAT_start_time')),
+            submission_time=_qstat_time(
+                element.findtext('JB_submission_time')),
+        )
+
+        # drop finished jobs so memory does not grow with the queue length
+        parents[-1].clear()
+        yield new_one
+
+
+def count_tasks(tasks: typing.Optional[str]
+                ) -> typing.Tuple[int, typing.Optional[int],
+                                  typing.Optional[int]]:
+    # '1-99:2,101' -> (number of tasks, first task, last task)
+    if not tasks:
+        return (1, None, None)
+    count = 0
+    first: typing.Optional[int] = None
+    last: typing.Optional[int] = None
+    for one in tasks.split(','):
+        if '-' in one:
+            task_range, _, step = one.partition(':')
+            begin, end = [int(x) for x in task_range.split('-', 1)]
+            end = begin + (end - begin) // int(step or 1) * int(step or 1)
+            count += (end - begin) // int(step or 1) + 1
+        else:
+            begin = end = int(one)
+            count += 1
+        first = begin if first is None else min(first, begin)
+        last = end if last is None else max(last, end)
+    return (count, first, last)
+
+
+class JobGroup:
+    # tasks of one job number collapsed into a single record
+    __slots__ = ('job_id', 'owner', 'name', 'slots', 'running', 'queued',
+                 'hold', 'other', 'first_task', 'last_task', 'first_start',
+                 'last_start', 'submission_time')
+
+    def __init__(self, job: QstatJob):
+        self.job_id = job.job_id
+        self.owner = job.owner
+        self.name = job.name
+        self.slots = int(job.slots)
+        self.running = 0
+        self.queued = 0
+        self.hold = 0
+        self.other = 0
+        self.first_task: typing.Optional[int] = None
+        self.last_task: typing.Optional[int] = None
+        self.first_start: typing.Optional[datetime.datetime] = None
+        self.last_start: typing.Optional[datetime.datetime] = None
+        self.submission_time = job.submission_time
+
+    def add(self, job: QstatJob):
+        count, first, last = count_tasks(job.tasks)
+        if job.state in ('r', 'Rr', 't'):
+            self.running += count
+        elif job.state == 'qw':
+            self.queued += count
+        elif job.state == 'hqw':
+            self.hold += count
+        else:
+            self.other += count
+
+        if first is not None and last is not None:
+            self.first_task = first if self.first_task is None else min(
+                self.first_task, first)
+            self.last_task = last if self.last_task is None else max(
+                self.last_task, last)
+        if job.start_time is not None:
+            self.first_start = job.start_time \
+                if self.first_start is None \
+                else min(self.first_start, job.start_time)
+            self.last_start = job.start_time \
+                if self.last_start is None \
+                else max(self.last_start, job.start_time)
+        if job.submission_time is not None and \
+           (self.submission_time is None
+                or job.submission_time < self.submission_time):
+            self.submission_time = job.submission_time
+
+    @property
+    def task_range(self) -> str:
+        if self.first_task is None:
+            return ''
+        if self.first_task == self.last_task:
+            return str(self.first_task)
+        return '{}-{}'.format(self.first_task, self.last_task)
+
+
+def group_job(groups: typing.Dict[str, JobGroup], job: QstatJob):
+    group = groups.get(job.job_id)
+    if group is None:
+        group = groups[job.job_id] = JobGroup(job)
+    group.add(job)
+
+
+def aggregate_jobs(jobs: typing.Iterable[QstatJob]) -> typing.List[JobGroup]:
+    groups: typing.Dict[str, JobGroup] = collections.OrderedDict()
+    for one in jobs:
+        group_job(groups, one)
+    return list(groups.values())
+
+
+# qstat -s codes that include each state shown by grid
+QSTAT_STATE_FILTER = {
+    'r': 'r',
+    'Rr': 'r',
+    't': 'r',
+    'qw': 'p',
+    'hqw': 'p',
+    's': 's',
+}
+
+QSTAT_ALL_ARGS = ['-u', '*']
+
+
+def qstat_args(user: str = '*',
+               state: str = '*',
+               queue: typing.Optional[str] = None) -> typing.List[str]:
+    # -s codes cover several states, so callers still check each job
+    args = ['-u', user]
+    if state != '*' and state in QSTAT_STATE_FILTER:
+        args += ['-s', QSTAT_STATE_FILTER[state]]
+    if queue:
+        args += ['-q', queue]
+    return args
+
+
+def queue_matches(queue_name: typing.Optional[str],
+                  queue: typing.Optional[str]) -> bool:
+    # queue is a comma separated list of queues or queue@host,
+    # wildcards allowed
+    if not queue:
+        return True
+    if queue_name is None:
+        return False
+    cluster_queue = queue_name.split('@', 1)[0]
+    return any(
+        fnmatch.fnmatchcase(queue_name, x)
+        or fnmatch.fnmatchcase(cluster_queue, x) for x in queue.split(','))
+
+
+def get_default_qstat_cache_path() -> str:
+    return os.path.expanduser('~/.grid.qstat.json')
+
+
+QSTAT_CACHE_VERSION = 1
+
+
+def _read_qstat_cache(
+        cache_path: str, max_age: float,
+        args: typing.List[str]) -> typing.Optional[typing.List[QstatJob]]:
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or \
+       cache.get('version') != QSTAT_CACHE_VERSION:
+        return None
+
+    def decode(row: list) -> QstatJob:
+        job = QstatJob(*row)
+        return job._replace(
+            start_time=job.start_time
+            and datetime.datetime.fromisoformat(job.start_time),
+            submission_time=job.submission_time
+            and datetime.datetime.fromisoformat(job.submission_time))
+
+    # anything written by another version or tool is a miss, not an error
+    try:
+        # a whole-cluster result also answers any filtered query
+        if cache.get('args') not in (args, QSTAT_ALL_ARGS) or \
+           time.time() - cache.get('created', 0) > max_age:
+            return None
+        return [decode(x) for x in cache['jobs']]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _qstat_cache_slot(cache_path: str, args: typing.List[str]) -> str:
+    if args == QSTAT_ALL_ARGS:
+        return cache_path
+    # filtered queries get their own slot and never evict the whole
+    # cluster result
+    return '{}.{}'.format(
+        cache_path,
+        hashlib.sha1(json.dumps(args).encode('utf-8')).hexdigest()[:12])
+
+
+def _write_qstat_cache(cache_path: str, args: typing.List[str],
+                       jobs: typing.List[QstatJob]):
+    def encode(value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        raise TypeError(repr(value))
+
+    cache = {
+        'version': QSTAT_CACHE_VERSION,
+        'created': time.time(),
+        'args': args,
+        'jobs': jobs
+    }
+    # rewritten in place, as a shared sticky directory does not let
+    # other users replace the file. Readers that see a partial write
+    # fail to parse it and wait on the lock held by the writer.
+    with os.fdopen(fileutils.open_shared(cache_path, os.O_WRONLY | os.O_TRUNC),
+                   'w') as f:
+        json.dump(cache, f, default=encode)
+
+
+def cached_qstat(
+        cache_path: str,
+        max_age: float,
+        args: typing.List[str] = QSTAT_ALL_ARGS
+) -> typing.Iterable[QstatJob]:
+    # processes sharing cache_path run at most one qstat per max_age;
+    # a whole-cluster result may be returned, so callers filter jobs
+    if max_age <= 0:
+        return qstat(args)
+
+    slot = _qstat_cache_slot(cache_path, args)
+    for one in dict.fromkeys([cache_path, slot]):
+        jobs = _read_qstat_cache(one, max_age, args)
+        if jobs is not None:
+            return jobs
+
+    try:
+        lock = os.fdopen(
+            fileutils.open_shared(slot + '.lock', os.O_RDWR), 'r+')
+    except OSError:
+        return qstat(args)
+    with lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        except OSError:
+            return qstat(args)
+        # another process may have refreshed it while we were waiting
+        jobs = _read_qstat_cache(slot, max_age, args)
+        if jobs is not None:
+            return jobs
+        jobs = list(qstat(args))
+        try:
+            _write_qstat_cache(slot, args, jobs)
+        except OSError:
+            # the cache only saves qstat calls; never fail because of it
+            pass
     return jobs
 
 
+def qstat(
+        args: typing.List[str] = QSTAT_ALL_ARGS) -> typing.Iterator[QstatJob]:
+    process = subprocess.Popen(['qstat', '-xml', '-r'] + args,
+                               stdout=subprocess.PIPE)
+    assert process.stdout is not None
+    with process:
+        yield from parse_qstat_xml(process.stdout)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
 if __name__ == '__main__':
     _main()
@@ -16,6 +16,9 @@ setup(
     install_requires=[
         "requests>=2.22.0"
     ],
+    extras_require={
+        "export": ["pyarrow"]
+    },
     classifiers = [
         "Development Status :: 3 - Alpha",
         "Environment :: Console",
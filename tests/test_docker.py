@@ -1,3 +1,9 @@
+import http.server
+import json
+import os
+import threading
+import typing
+
 from cromwellhelper.docker import *
 
 
@@ -55,3 +61,70 @@ def test_get_manifest():
             'sha256:7a6fd3b689d0f98a11b44a40c6641eeb56aa370b4b54623958eddf52034c2c09',
             False, 'gcr.io/google-containers/cloud-controller-manager-amd64'))
     assert manifest.sha256hash == 'sha256:7a6fd3b689d0f98a11b44a40c6641eeb56aa370b4b54623958eddf52034c2c09'
+
+
+class _Registry(http.server.BaseHTTPRequestHandler):
+    requests: typing.List[str] = []
+    failures = 0
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        host = 'http://{}:{}'.format(*self.server.server_address)
+        if self.path.startswith('/token'):
+            body = json.dumps({'token': 'abc', 'expires_in': 300})
+        elif _Registry.failures > 0:
+            _Registry.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        elif self.headers.get('Authorization') != 'Bearer abc':
+            self.send_response(401)
+            self.send_header(
+                'Www-Authenticate',
+                'Bearer realm="{}/token",service="test",'
+                'scope="repository:library/alpine:pull"'.format(host))
+            self.end_headers()
+            return
+        else:
+            body = '{}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def test_token_cache(tmpdir):
+    server = http.server.HTTPServer(('127.0.0.1', 0), _Registry)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}/v2/library/alpine/manifests/3.11'.format(
+        *server.server_address)
+    try:
+        cache = TokenCache()
+        result, token = docker_api_call(url, token_cache=cache)
+        assert result.status_code == 200
+        assert token == 'abc'
+        assert len(_Registry.requests) == 3
+
+        # a known repository is sent the cached token directly
+        _Registry.requests.clear()
+        docker_api_call(url, token_cache=cache)
+        assert len(_Registry.requests) == 1
+
+        # and so is a later process loading the saved cache
+        path = os.path.join(tmpdir, 'tokens.json')
+        cache.save(path)
+        cache = TokenCache()
+        cache.load(path)
+        _Registry.requests.clear()
+        _Registry.failures = 1
+        docker_api_call(url, token_cache=cache)
+        # one retried 503
+        assert len(_Registry.requests) == 2
+    finally:
+        server.shutdown()
+
+    cache.put('realm', 'service', 'scope', 'expired', 1)
+    assert cache.get('realm', 'service', 'scope') is None
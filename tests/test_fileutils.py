@@ -1,5 +1,7 @@
 import os
 import os.path
+import threading
+import time
 
 from cromwellhelper.fileutils import *
 
@@ -59,3 +61,70 @@ def test_search_symlinks():
         ('b/six', 'b/four', 'a/one'),
         ('b/three', 'a/one', 'a/one'),
     ]
+
+
+def test_path_resolver(tmpdir):
+    testfiles_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                 "testfiles", "link")
+    resolver = PathResolver()
+    assert resolver.realpath(os.path.join(testfiles_dir, "c", "six")) == \
+        os.path.join(testfiles_dir, "a", "one")
+    # shared parent directories are resolved once and reused
+    assert resolver.cache[testfiles_dir] == testfiles_dir
+    assert resolver.realpath(os.path.join(testfiles_dir, "c")) == \
+        os.path.join(testfiles_dir, "b")
+
+    assert sorted(search_symlinks(testfiles_dir, resolver)) == \
+        sorted(search_symlinks(testfiles_dir))
+    assert search_symlinks(os.path.join(tmpdir, 'missing')) == []
+
+
+def test_search_symlinks_parallel(tmpdir):
+    for i in range(20):
+        os.makedirs(os.path.join(tmpdir, 'data', str(i)))
+        for j in range(10):
+            one = os.path.join(tmpdir, 'data', str(i), str(j))
+            open(one, 'w').close()
+            os.makedirs(os.path.join(tmpdir, 'inputs', str(i), str(j)))
+            os.symlink(one, os.path.join(tmpdir, 'inputs', str(i), str(j),
+                                         'file'))
+    os.symlink(os.path.join(tmpdir, 'data'),
+               os.path.join(tmpdir, 'inputs', 'directory'))
+
+    inputs = os.path.join(tmpdir, 'inputs')
+    serial = sorted(search_symlinks(inputs))
+    assert len(serial) == 200
+    assert sorted(search_symlinks(inputs, workers=4)) == serial
+
+
+def test_exclusive_lock(tmpdir):
+    path = os.path.join(tmpdir, 'image.lock')
+    # e.g. left behind by another user's failed build
+    with open(path, 'w'):
+        pass
+    os.chmod(path, 0o644)
+
+    old_umask = os.umask(0o022)
+    try:
+        with exclusive_lock(path):
+            assert os.stat(path).st_mode & 0o777 == 0o666
+    finally:
+        os.umask(old_umask)
+    assert not os.path.exists(path)
+
+    # waiters woken on the removed file lock a new one
+    order = []
+
+    def hold(name):
+        with exclusive_lock(path):
+            order.append(name)
+            time.sleep(0.1)
+            order.append(name)
+
+    threads = [threading.Thread(target=hold, args=(x, )) for x in 'ab']
+    for one in threads:
+        one.start()
+    for one in threads:
+        one.join()
+    assert order in (['a', 'a', 'b', 'b'], ['b', 'b', 'a', 'a'])
+    assert not os.path.exists(path)
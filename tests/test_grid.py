@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+
+import pytest
+
+import cromwellhelper.grid as grid
+from cromwellhelper.grid import *
+
+QSTAT_XML = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                         'testfiles', 'uge', 'qstat.xml')
+
+
+def fixture_jobs(monkeypatch):
+    with open(QSTAT_XML, 'rb') as f:
+        jobs = list(uge.parse_qstat_xml(f))
+    # as if a fresh whole-cluster result was in the cache
+    monkeypatch.setattr(uge, 'cached_qstat', lambda *args: jobs)
+    return jobs
+
+
+def test_tablist_queue(monkeypatch, capsys):
+    fixture_jobs(monkeypatch)
+    options = argparse.Namespace(qstat_cache='', max_age=10, user='*',
+                                 state='*', queue='all.q@node020')
+    tablist(options)
+    assert [x.split('\t')[0] for x in capsys.readouterr().out.splitlines()
+            ] == ['bob']
+
+    options.queue = 'short.q'
+    tablist(options)
+    assert capsys.readouterr().out == ''
+
+
+def test_stat_summary(monkeypatch, capsys):
+    fixture_jobs(monkeypatch)
+    options = argparse.Namespace(qstat_cache='', max_age=10, user='alice',
+                                 all_users_summary=False, aggregate=False)
+    stat(options)
+    summary = capsys.readouterr().out.split('Summary')[1]
+    assert 'alice' in summary
+    assert 'bob' not in summary
+
+    options.all_users_summary = True
+    stat(options)
+    assert 'bob' in capsys.readouterr().out.split('Summary')[1]
+
+
+def test_stat_aggregate(monkeypatch, capsys):
+    jobs = fixture_jobs(monkeypatch)
+    # qstat output is streamed and can only be read once
+    monkeypatch.setattr(uge, 'cached_qstat', lambda *args: iter(jobs))
+    options = argparse.Namespace(qstat_cache='', max_age=10, user='*',
+                                 all_users_summary=False, aggregate=True)
+    stat(options)
+    jobs_table, summary = capsys.readouterr().out.split('Summary')
+    assert '7-100' in jobs_table
+    assert 'bob   |             1 |            1 |            1' in summary
+
+
+def test_top_rows():
+    with open(QSTAT_XML, 'rb') as f:
+        groups = uge.aggregate_jobs(uge.parse_qstat_xml(f))
+
+    rows = top_rows(groups)
+    assert list(rows.keys()) == ['1843210', '1843215', '1843300']
+    assert rows['1843215'][4:8] == ('7-100', '1', '93', '0')
+
+    # slot totals count every task of an array job
+    assert top_user_rows(groups) == [('alice', '4', '0', '2'),
+                                     ('bob', '1', '93', '0')]
+
+    lines = format_columns([TOP_USER_HEADER] + top_user_rows(groups))
+    assert lines[0] == 'User  Running slots Queued slots Hold slots'
+    assert lines[2] == 'bob   1             93           0'
+
+    assert changed_rows({}, rows) == set()
+    assert changed_rows(rows, rows) == set()
+    previous = dict(rows)
+    del previous['1843300']
+    previous['1843215'] = previous['1843215'][:5] + ('0', '94', '0', '')
+    assert changed_rows(previous, rows) == {'1843215', '1843300'}
+
+
+def test_export_stdout_format(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv',
+                        ['grid', 'export', '-', '--format', 'parquet'])
+    with pytest.raises(SystemExit):
+        grid._main()
+    assert 'only CSV can be written to stdout' in capsys.readouterr().err
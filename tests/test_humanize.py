@@ -1,3 +1,5 @@
+import datetime
+
 from cromwellhelper.humanize import *
 
 
@@ -36,3 +38,20 @@ def test_humanize_time_delta():
                                                   24)) == "1 day"
     assert humanize_time_delta(datetime.timedelta(seconds=60 * 60 * 24 *
                                                   2)) == "2 days"
+
+
+def test_format_duration():
+    assert format_duration(0) == '0.000s'
+    assert format_duration(59.9995) == '59.999s'
+    assert format_duration(60) == '60.000s'
+    assert format_duration(61.5) == '1m 1.500s'
+    assert format_duration(3600) == '60m 0.000s'
+    assert format_duration(3661.25) == '1h 1m 1.250s'
+    assert format_duration(90061.0015) == '1d 1h 1m 1.001s'
+    assert format_duration_microseconds(86400 * 1000000) == '1d 0.000s'
+
+
+def test_format_timestamp():
+    for one in [0, 999, 1600000000000, 1600000000999]:
+        assert format_timestamp(one) == datetime.datetime.fromtimestamp(
+            one / 1000).strftime('%Y/%m/%d %H:%M:%S')
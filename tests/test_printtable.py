@@ -0,0 +1,52 @@
+import io
+
+import pytest
+
+from cromwellhelper.printtable import *
+
+
+def test_pretty_table_stream():
+    rows = [('name', 'slots'), ('a', 1), ('bbb', 12)]
+
+    buffered = PrettyTable()
+    for one in rows:
+        buffered.add_row(*one)
+    expected = io.StringIO()
+    buffered.p(expected)
+    assert expected.getvalue() == 'name | slots\na    |     1\nbbb  |    12\n'
+
+    output = io.StringIO()
+    table = PrettyTable(stream=True, output=output)
+    for one in rows:
+        table.add_row(*one)
+    assert output.getvalue() == ''
+    table.p()
+    assert output.getvalue() == expected.getvalue()
+
+    # rows still buffered go to the output given to p()
+    output = io.StringIO()
+    table = PrettyTable(stream=True)
+    for one in rows:
+        table.add_row(*one)
+    table.p(output)
+    assert output.getvalue() == expected.getvalue()
+
+
+def test_pretty_table_lookahead():
+    output = io.StringIO()
+    table = PrettyTable(stream=True, lookahead=2, output=output)
+    table.add_row('name', 'slots')
+    table.add_row('a', 1)
+    # widths are fixed once the look-ahead window is full
+    assert output.getvalue() == 'name | slots\na    |     1\n'
+    table.add_row('longer name', 2)
+    assert table.rows == []
+    table.p()
+    assert output.getvalue().splitlines()[-1] == 'longer name |     2'
+    with pytest.raises(Exception):
+        table.p(io.StringIO())
+
+    output = io.StringIO()
+    table = PrettyTable(stream=True, widths=[6, 3], output=output)
+    table.add_row('a', 1)
+    assert output.getvalue() == 'a      |   1\n'
@@ -54,6 +54,44 @@ def test_update_tag_link(tmpdir):
                 'alpine@sha256:7c3773f7bcc969f03f8f653910001d99a9d324b4b9caa008846ad2c3089f5a5f'
             ))
 
+    assert sorted(os.listdir(os.path.join(tmpdir, 'tag'))) == [
+        'alpine:3.10.sif', 'alpine:3.11.sif'
+    ]
+
+
+def test_pull_image_atomic(tmpdir):
+    fake = os.path.join(tmpdir, 'singularity')
+    with open(fake, 'w') as f:
+        f.write('#!/bin/sh\necho "$3" >> "$(dirname "$0")/calls"\n'
+                'echo image > "$2"\n')
+    os.chmod(fake, 0o755)
+    store = os.path.join(tmpdir, 'store')
+    hash_name = parse_image_name(
+        'alpine@sha256:'
+        'ab00606a42621fb68f2ed6ad3c88be54397f981a7b70a79db3d1172b11c4367d')
+    pull_image(fake, store, hash_name)
+    pull_image(fake, store, hash_name)
+    with open(os.path.join(tmpdir, 'calls')) as f:
+        assert len(f.readlines()) == 1
+    assert sorted(os.listdir(os.path.join(store, 'sha256'))) == [
+        'alpine@sha256:'
+        'ab00606a42621fb68f2ed6ad3c88be54397f981a7b70a79db3d1172b11c4367d.sif',
+    ]
+
+    # a failed build leaves neither an image nor a temporary file
+    with open(fake, 'w') as f:
+        f.write('#!/bin/sh\necho partial > "$2"\nexit 1\n')
+    failed_name = parse_image_name(
+        'alpine@sha256:'
+        '7c3773f7bcc969f03f8f653910001d99a9d324b4b9caa008846ad2c3089f5a5f')
+    with pytest.raises(Exception):
+        pull_image(fake, store, failed_name)
+    assert not os.path.exists(image_path(store, failed_name))
+    assert not [
+        x for x in os.listdir(os.path.join(store, 'sha256'))
+        if x.endswith('.tmp') or x.endswith('.lock')
+    ]
+
 
 def test_list_images():
     testfiles_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)),
@@ -79,3 +117,161 @@ def test_list_images():
                 'informationsea/vcfanno:v0.3.2-with-python-bcftools')
         }
     }
+
+
+def test_plan_binds():
+    links = [('/w/inputs/{}/a.bam'.format(i),
+              '/data/run1/sample{}/a.bam'.format(i),
+              '/data/run1/sample{}/a.bam'.format(i)) for i in range(10)]
+    links.append(('/w/inputs/ref.fa', '/ref.fa', '/ref.fa'))
+    # a symlink target keeps its own bind and its directory stays unbound
+    links.append(('/w/inputs/x.vcf', '/data/links/x.vcf',
+                  '/data/real/x.1.vcf'))
+    links.append(('/w/inputs/y.vcf', '/data/links/y.vcf', '/data/links/y.vcf'))
+
+    plan = plan_binds(links, max_binds=100)
+    assert len(plan.directories) == 10
+    assert plan.files == [('/data/links/y.vcf', '/data/links/y.vcf'),
+                          ('/data/real/x.1.vcf', '/data/links/x.vcf'),
+                          ('/ref.fa', '/ref.fa')]
+
+    plan = plan_binds(links, max_binds=4)
+    assert plan.directories == [('/data/run1', '/data/run1')]
+    assert len(plan.files) == 3
+
+    # /data is shallower than min_depth
+    plan = plan_binds(links, max_binds=1, min_depth=2)
+    assert plan.directories == [('/data/run1', '/data/run1')]
+
+    links = [('/w/inputs/a', '/x/y/z/a', '/x/y/z/a'),
+             ('/w/inputs/b', '/x/q/b', '/x/q/b')]
+    assert plan_binds(links, max_binds=1).directories == [('/x/q', '/x/q'),
+                                                          ('/x/y', '/x/y')]
+    assert plan_binds(links, max_binds=1,
+                      min_depth=1).directories == [('/x', '/x')]
+
+
+def test_plan_binds_symlinked_directory():
+    # e.g. /home is a symlink to /mnt/home
+    links = [('/w/inputs/{}.bam'.format(i),
+              '/home/u/run/sample{}/{}.bam'.format(i % 10, i),
+              '/mnt/home/u/run/sample{}/{}.bam'.format(i % 10, i))
+             for i in range(1000)]
+    plan = plan_binds(links, max_binds=64)
+    assert len(plan.directories) == 10
+    assert plan.files == []
+    assert ('/mnt/home/u/run/sample3', '/home/u/run/sample3') in \
+        plan.directories
+
+    plan = plan_binds(links, max_binds=4)
+    assert plan.directories == [('/mnt/home/u/run', '/home/u/run')]
+
+
+def test_image_index(tmpdir):
+    hash_name = parse_image_name(
+        'alpine@sha256:'
+        'ddba4d27a7ffc3f86dd6c2f92041af252a1f23a8e742c90e6e1297bfa1bc0c45')
+    hash_path = image_path(tmpdir, hash_name)
+    os.makedirs(os.path.dirname(hash_path))
+    with open(hash_path, 'w') as f:
+        f.write('image')
+    update_tag_link(tmpdir, parse_image_name('alpine:3.11'), hash_name)
+    # writes leave the index to readers
+    assert not os.path.exists(os.path.join(tmpdir, 'index.json'))
+    assert load_index(tmpdir) is None
+    # changed just now; the index cannot tell later changes apart yet
+    build_index(tmpdir)
+    assert load_index(tmpdir) is None
+
+    for one in ('tag', 'sha256'):
+        os.utime(os.path.join(tmpdir, one), (1000000000, 1000000000))
+    build_index(tmpdir)
+    assert load_index(tmpdir) is not None
+    images = indexed_images(tmpdir)
+    assert images[hash_name].size == 5
+    assert images[hash_name].tags == {parse_image_name('alpine:3.11')}
+    assert find_image(tmpdir, parse_image_name('alpine:3.11')) == \
+        os.path.realpath(hash_path)
+    assert find_image(tmpdir, hash_name) == os.path.realpath(hash_path)
+    assert find_image(tmpdir, parse_image_name('alpine:3.10')) is None
+    # as with fakedocker --default-registry
+    assert find_image(tmpdir, parse_image_name(
+        'alpine:3.11', 'registry.example.org')) == os.path.realpath(hash_path)
+
+    # a tag added behind the index's back makes it stale
+    os.makedirs(os.path.join(tmpdir, 'tag', 'informationsea'))
+    assert load_index(tmpdir) is None
+    assert len(indexed_images(tmpdir)) == 1
+
+
+def test_pull_images(tmpdir, monkeypatch):
+    fake = os.path.join(tmpdir, 'singularity')
+    with open(fake, 'w') as f:
+        f.write('#!/bin/sh\necho "$3" >> "$(dirname "$0")/calls"\n'
+                'echo image > "$2"\n')
+    os.chmod(fake, 0o755)
+    store = os.path.join(tmpdir, 'store')
+
+    digests = {
+        'library/alpine:3.11': 'sha256:' + '1' * 64,
+        'library/alpine:latest': 'sha256:' + '1' * 64,
+        'library/ubuntu:20.04': 'sha256:' + '2' * 64,
+    }
+
+    def get_manifest(image_name, token=None):
+        key = image_name.name + ':' + image_name.reference
+        if key not in digests:
+            raise Exception('manifest unknown')
+        return Manifest(digests[key], '{}', {}, None)
+
+    monkeypatch.setattr(docker, 'get_manifest', get_manifest)
+    names = [
+        parse_image_name(x) for x in [
+            'alpine:3.11', 'alpine:latest', 'ubuntu:20.04', 'ubuntu:20.04',
+            'missing:1'
+        ]
+    ]
+    failed = pull_images(fake, store, names)
+    assert list(failed.keys()) == [parse_image_name('missing:1')]
+    with open(os.path.join(tmpdir, 'calls')) as f:
+        assert len(f.readlines()) == 2
+    assert find_image(store, parse_image_name('alpine:latest')) == \
+        find_image(store, parse_image_name('alpine:3.11'))
+    assert find_image(store, parse_image_name('ubuntu:20.04'))
+
+
+def test_resolve_image_cache(tmpdir, monkeypatch):
+    calls = []
+    current = ['sha256:' + '1' * 64]
+
+    def get_manifest(image_name, token=None):
+        calls.append('GET')
+        return Manifest(current[0], '{}', {}, None)
+
+    def get_manifest_digest(image_name, token=None):
+        calls.append('HEAD')
+        return current[0]
+
+    monkeypatch.setattr(docker, 'get_manifest', get_manifest)
+    monkeypatch.setattr(docker, 'get_manifest_digest', get_manifest_digest)
+    tag = parse_image_name('alpine:3.11')
+
+    assert resolve_image(tag, tmpdir).reference == current[0]
+    assert resolve_image(tag, tmpdir).reference == current[0]
+    assert calls == ['GET']
+
+    # expired entries are revalidated and fetched only if the tag moved
+    calls.clear()
+    assert resolve_image(tag, tmpdir, manifest_ttl=0).reference == current[0]
+    current[0] = 'sha256:' + '2' * 64
+    assert resolve_image(tag, tmpdir, manifest_ttl=0).reference == current[0]
+    assert calls == ['HEAD', 'HEAD', 'GET']
+
+    calls.clear()
+    assert resolve_image(tag, tmpdir, offline=True).reference == current[0]
+    assert calls == []
+    with pytest.raises(Exception):
+        resolve_image(parse_image_name('alpine:3.10'), tmpdir, offline=True)
+    # offline pulls never build
+    with pytest.raises(Exception):
+        pull_image('false', tmpdir, tag, offline=True)
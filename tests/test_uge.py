@@ -0,0 +1,608 @@
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from cromwellhelper.uge import *
+
+
+def accounting_line(job_number: int, task_number: int = 0) -> str:
+    values = {
+        'qname': 'all.q',
+        'hostname': 'node001',
+        'owner': 'alice',
+        'job_name': 'job{}'.format(job_number),
+        'job_number': str(job_number),
+        'submission_time': '1600000000000',
+        'start_time': '1600000010000',
+        'end_time': '1600000070000',
+        'ru_wallclock': '60',
+        'ru_utime': '30',
+        'ru_stime': '6',
+        'slots': '1',
+        'task_number': str(task_number),
+        'category': '-l mem_req=2G,s_vmem=2G',
+        'maxvmem': str(1024 * 1024 * 1024),
+        'wallclock': '60',
+    }
+    return ':'.join(values.get(x[0], '0') for x in ACCOUNTING_ITEMS) + '\n'
+
+
+def test_parse_accounting_line():
+    assert parse_accounting_line('# Version: 8.6.0\n') is None
+    assert parse_accounting_line('') is None
+
+    row = parse_accounting_line(accounting_line(10, 2))
+    assert len(row) == len(ACCOUNTING_ITEMS) + len(DERIVED_ITEMS)
+    assert row[5] == '10'
+    derived = dict(zip([x[0] for x in DERIVED_ITEMS],
+                       row[len(ACCOUNTING_ITEMS):]))
+    assert derived == {
+        'job_id': '10.2',
+        'cpu_time': 36.0,
+        'expected_cpu_time': 60.0,
+        'cpu_use_percent': 60.0,
+        'mem_req': 2 * 1024 * 1024 * 1024,
+        'total_mem_req': 2 * 1024 * 1024 * 1024,
+        's_vmem': 2 * 1024 * 1024 * 1024,
+        'total_s_vmem': 2 * 1024 * 1024 * 1024,
+        'maxvmem_bytes': 1024 * 1024 * 1024,
+        'memory_use_percent': 50.0,
+    }
+
+    row = parse_accounting_line('all.q:node001:users\n')
+    assert len(row) == len(ACCOUNTING_ITEMS) + len(DERIVED_ITEMS)
+    assert row[:3] == ['all.q', 'node001', 'users']
+    assert row[3:] == [None] * (len(row) - 3)
+
+
+def test_load_data():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    accounting = io.StringIO('# Version: 8.6.0\n' +
+                             ''.join(accounting_line(x) for x in range(25)))
+
+    assert load_data(db, accounting, batch_size=10) == 25
+    assert db.execute('SELECT COUNT(*) FROM accounting').fetchone()[0] == 25
+    assert db.execute('SELECT processed_bytes FROM accounting_files'
+                      ).fetchone()[0] == accounting.tell()
+
+    accounting.seek(0, io.SEEK_END)
+    accounting.write(accounting_line(100, 3))
+    accounting.seek(0)
+
+    assert load_data(db, accounting, batch_size=10) == 1
+    one = db.execute('SELECT * FROM accounting WHERE job_number = 100'
+                     ).fetchone()
+    assert one['task_number'] == 3
+    assert one['owner'] == 'alice'
+
+
+def test_load_data_checkpoint():
+    class Interrupted(Exception):
+        pass
+
+    class InterruptingStream(io.StringIO):
+        def readline(self, *args):
+            line = super().readline(*args)
+            if ':job15:' in line:
+                raise Interrupted()
+            return line
+
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    data = ''.join(accounting_line(x) for x in range(20))
+
+    try:
+        load_data(db, InterruptingStream(data), batch_size=4,
+                  checkpoint_rows=5)
+    except Interrupted:
+        pass
+    assert db.execute('SELECT COUNT(*) FROM accounting').fetchone()[0] == 15
+
+    assert load_data(db, io.StringIO(data), checkpoint_rows=5) == 5
+    assert db.execute('SELECT COUNT(*) FROM accounting').fetchone()[0] == 20
+
+
+def test_resume_position():
+    assert resume_position(None, 100) == 0
+    assert resume_position(Progress(50, 10, 80), 100) == 50
+    assert resume_position(Progress(50, None, None), None) == 50
+    assert resume_position(Progress(50, 10, 80), None) == 50
+    # truncated
+    assert resume_position(Progress(50, 10, 80), 40) == 0
+    assert resume_position(Progress(50, 10, 80), 60) == 0
+
+
+def test_legacy_progress():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    data = ''.join(accounting_line(x) for x in range(10))
+    create_tables(db)
+    db.executemany(INSERT_ACCOUNTING_SQL,
+                   [parse_accounting_line(x) for x in data.splitlines()[:4]])
+    db.execute('CREATE TABLE processed_bytes(processed_bytes INTEGER)')
+    db.execute('INSERT INTO processed_bytes VALUES(?)',
+               (len(''.join(data.splitlines(True)[:4])), ))
+    db.commit()
+
+    assert load_data(db, io.StringIO(data)) == 6
+    assert db.execute('SELECT COUNT(*) FROM accounting').fetchone()[0] == 10
+    assert not db.execute("SELECT * FROM sqlite_master WHERE " +
+                          "name = 'processed_bytes'").fetchone()
+
+
+def test_load_accounting_files(tmpdir):
+    accounting = os.path.join(tmpdir, 'accounting')
+    lines = [accounting_line(x) for x in range(30)]
+
+    with gzip.open(accounting + '.2.gz', 'wt') as f:
+        f.write(''.join(lines[:10]))
+    with bz2.open(accounting + '.1.bz2', 'wt') as f:
+        f.write(''.join(lines[10:20]))
+    with open(accounting, 'w') as f:
+        f.write(''.join(lines[20:25]))
+    os.utime(accounting + '.2.gz', (1000, 1000))
+    os.utime(accounting + '.1.bz2', (2000, 2000))
+
+    assert find_accounting_files(accounting) == [
+        accounting + '.2.gz', accounting + '.1.bz2', accounting
+    ]
+
+    db = sqlite3.connect(os.path.join(tmpdir, 'db.sqlite3'))
+    db.row_factory = sqlite3.Row
+    assert load_accounting_files(db, accounting) == 25
+    assert load_accounting_files(db, accounting) == 0
+    assert not load_accounting_files(db, accounting, rotated=False)
+
+    # rotate: live file is compressed and a new one is started
+    with open(accounting, 'a') as f:
+        f.write(''.join(lines[25:28]))
+    with open(accounting) as src, \
+            lzma.open(accounting + '.0.xz', 'wt') as dest:
+        dest.write(src.read())
+    os.remove(accounting)
+    with open(accounting, 'w') as f:
+        f.write(''.join(lines[28:]))
+
+    assert load_accounting_files(db, accounting) == 5
+    assert [x[0] for x in db.execute(
+        'SELECT job_number FROM accounting ORDER BY rowid')] == \
+        list(range(30))
+
+
+def test_split_ranges():
+    data = b''.join(accounting_line(x).encode('utf-8') for x in range(20))
+    accounting = io.BytesIO(data + b'partial:line')
+
+    ranges = split_ranges(accounting, 0, 1000)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    for (_, end), (begin, _) in zip(ranges, ranges[1:]):
+        assert end == begin
+        assert data[end - 1:end] == b'\n'
+
+    assert split_ranges(accounting, len(data), 1000) == []
+
+
+def test_load_data_parallel(tmpdir):
+    accounting = os.path.join(tmpdir, 'accounting')
+    with open(accounting, 'w') as f:
+        f.write('# Version: 8.6.0\n' +
+                ''.join(accounting_line(x) for x in range(200)))
+
+    db = sqlite3.connect(os.path.join(tmpdir, 'db.sqlite3'))
+    assert load_data_parallel(db, accounting, processes=2, chunk_bytes=4096,
+                              checkpoint_rows=50) == 200
+    assert [x[0] for x in db.execute(
+        'SELECT job_number FROM accounting ORDER BY rowid')] == \
+        list(range(200))
+
+    with open(accounting, 'a') as f:
+        f.write(''.join(accounting_line(x) for x in range(200, 210)))
+    with open(accounting) as f:
+        assert load_data(db, f) == 10
+
+
+def test_load_data_partial_line(tmpdir):
+    accounting = os.path.join(tmpdir, 'accounting')
+    line = accounting_line(2)
+    with open(accounting, 'w') as f:
+        f.write(accounting_line(1) + line[:60])
+
+    db = sqlite3.connect(os.path.join(tmpdir, 'db.sqlite3'))
+    with open(accounting) as f:
+        assert load_data(db, f) == 1
+
+    # the rest of the line arrives before the next sync
+    with open(accounting, 'a') as f:
+        f.write(line[60:])
+    with open(accounting) as f:
+        assert load_data(db, f) == 1
+    assert [x for x in db.execute(
+        'SELECT job_number, end_time IS NULL FROM accounting ORDER BY rowid')
+            ] == [(1, 0), (2, 0)]
+
+
+def test_last_sync(tmpdir):
+    accounting = os.path.join(tmpdir, 'accounting')
+    with open(accounting, 'w') as f:
+        f.write(accounting_line(1))
+
+    db = sqlite3.connect(':memory:')
+    assert get_last_sync(db) is None
+    load_accounting_files(db, accounting)
+    assert get_last_sync(db) > 0
+
+    set_last_sync(db, 123.0)
+    assert get_last_sync(db) == 123.0
+
+
+def test_migrate_schema():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    db.execute('CREATE TABLE accounting(' +
+               ','.join(['"{}" {}'.format(*x)
+                         for x in ACCOUNTING_ITEMS]) + ')')
+    db.execute('INSERT INTO accounting VALUES(' +
+               ','.join('?' for x in ACCOUNTING_ITEMS) + ')',
+               parse_accounting_line(accounting_line(7))[:len(
+                   ACCOUNTING_ITEMS)])
+    db.commit()
+
+    create_tables(db)
+    assert db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    one = db.execute('SELECT * FROM accounting').fetchone()
+    assert one['job_id'] == '7'
+    assert one['memory_use_percent'] == 50.0
+    assert one['maxvmem_bytes'] == 1024 * 1024 * 1024
+
+
+def test_migrate_schema_concurrent(tmpdir):
+    path = os.path.join(tmpdir, 'db.sqlite3')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE accounting(' +
+               ','.join(['"{}" {}'.format(*x)
+                         for x in ACCOUNTING_ITEMS]) + ')')
+    row = parse_accounting_line(accounting_line(7))[:len(ACCOUNTING_ITEMS)]
+    db.executemany(
+        'INSERT INTO accounting VALUES(' +
+        ','.join('?' for x in ACCOUNTING_ITEMS) + ')', [row] * 50000)
+    db.commit()
+    db.close()
+
+    # e.g. the sync daemon and a query opening an old database together
+    errors = []
+
+    def open_database():
+        try:
+            db = sqlite3.connect(path, timeout=0.1)
+            create_tables(db)
+            db.commit()
+            db.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=open_database) for _ in range(3)]
+    for one in threads:
+        one.start()
+    for one in threads:
+        one.join()
+    assert errors == []
+    db = sqlite3.connect(path)
+    assert db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    assert db.execute('SELECT COUNT(*) FROM accounting '
+                      'WHERE maxvmem_bytes IS NULL').fetchone()[0] == 0
+
+
+def test_get_recent_data_filter():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    lines = [accounting_line(x) for x in range(3)]
+    # job 1 uses twice the CPU time
+    lines[1] = lines[1].replace(':30:6:', ':66:6:')
+    load_data(db, io.StringIO(''.join(lines)))
+
+    def job_numbers(**kwargs):
+        return [
+            x['job_number'] for x in get_recent_data(
+                db, owner='alice', days=100000, **kwargs)
+        ]
+
+    assert job_numbers() == [0, 1, 2]
+    assert job_numbers(min_cpu_use=100) == [1]
+    assert job_numbers(max_cpu_use=100) == [0, 2]
+    assert job_numbers(order_by='cpu')[-1] == 1
+    assert job_numbers(min_memory_use=60) == []
+
+    one = add_info_to_record(dict(next(get_recent_data(
+        db, owner='alice', days=100000))))
+    assert one['cpu_use%'] == 60.0
+    assert one['memory_use%'] == 50.0
+    assert one['maxvmem'] == 1024 * 1024 * 1024
+    assert 'cpu_use_percent' not in one
+
+
+def test_get_recent_data_columns():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    load_data(db, io.StringIO(''.join(accounting_line(x) for x in range(3))))
+
+    rows = list(get_recent_data(db,
+                                owner='*',
+                                days=100000,
+                                succeeded_only=True,
+                                columns=['job_id', 'cpu_use_percent']))
+    assert [tuple(x) for x in rows] == [('0', 60.0), ('1', 60.0),
+                                        ('2', 60.0)]
+    assert rows[0].keys() == ['job_id', 'cpu_use_percent']
+    assert [tuple(x) for x in get_job_records(db, 1, 0, ['owner'])] == \
+        [('alice', )]
+
+    with pytest.raises(Exception):
+        get_recent_data(db, owner='*', columns=['owner; DROP TABLE x'])
+
+    indexes = set(x[0] for x in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'"))
+    assert 'accounting__owner__end_time' in indexes
+    assert 'accounting__end_time__failed__exit_status' in indexes
+    assert 'accounting__owner' not in indexes
+
+    plan = ' '.join(x[3] for x in db.execute(
+        'EXPLAIN QUERY PLAN SELECT job_id FROM accounting ' +
+        'WHERE end_time > 0 AND owner = ?', ('alice', )))
+    assert 'accounting__owner__end_time' in plan
+
+
+def test_get_recommendations():
+    db = sqlite3.connect(':memory:')
+    lines = []
+    for i in range(10):
+        one = accounting_line(i).replace(':job{}:'.format(i),
+                                         ':cromwell_{:08x}_align:'.format(i))
+        lines.append(
+            one.replace(':1073741824:', ':{}:'.format((i + 1) * MEM_REQ_STEP)))
+    lines.append(accounting_line(10))
+    load_data(db, io.StringIO(''.join(lines)))
+
+    results = get_recommendations(db, days=100000, percentile=90, margin=1)
+    # job10 can give back memory, align needs more than it requests
+    assert [(x.name, x.jobs) for x in results] == [('job10', 1),
+                                                   ('align', 10)]
+    align = results[1]
+    assert align.maxvmem == 9 * MEM_REQ_STEP
+    assert align.cpu_parallelism == 0.6
+    assert align.recommended_slots == 1
+    assert align.recommended_mem_req == 9 * MEM_REQ_STEP
+    assert align.reserved_gb_hours == 2 * 60 * 10 / 3600
+
+    align = get_recommendations(db, days=100000, percentile=100,
+                                min_jobs=2)[0]
+    assert align.recommended_mem_req == 12 * MEM_REQ_STEP
+    assert len(get_recommendations(db, days=100000, min_jobs=2)) == 1
+    assert get_recommendations(db, 'name', days=100000)[0].jobs == 1
+
+
+def test_get_recommendations_without_window_functions(monkeypatch):
+    db = sqlite3.connect(':memory:')
+    lines = []
+    for i in range(20):
+        one = accounting_line(i).replace(':job{}:'.format(i),
+                                         ':job{}:'.format(i % 3))
+        lines.append(
+            one.replace(':1073741824:', ':{}:'.format((i + 1) * MEM_REQ_STEP)))
+    load_data(db, io.StringIO(''.join(lines)))
+
+    for kwargs in [{}, {'percentile': 50}, {'min_jobs': 7}]:
+        expected = get_recommendations(db, 'name', days=100000, **kwargs)
+        monkeypatch.setattr('cromwellhelper.uge.WINDOW_FUNCTIONS', False)
+        assert get_recommendations(db, 'name', days=100000,
+                                   **kwargs) == expected
+        monkeypatch.undo()
+
+
+def test_export_records(tmpdir):
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    load_data(db, io.StringIO(''.join(accounting_line(x) for x in range(5))))
+
+    assert export_format('a.parquet') == 'parquet'
+    assert export_format('a.txt') == 'csv'
+
+    csv_path = os.path.join(tmpdir, 'export.csv')
+    assert export_records(db, csv_path, chunk_rows=2) == 5
+    with open(csv_path) as f:
+        lines = f.read().splitlines()
+    assert lines[0].split(',')[-1] == 'memory_use_percent'
+    assert len(lines) == 6
+    assert os.listdir(tmpdir) == ['export.csv']
+
+    assert export_records(db, os.path.join(tmpdir, 'none.csv'),
+                          owner='bob') == 0
+    with pytest.raises(Exception):
+        export_records(db, '-', format='parquet')
+    assert not os.path.exists('-')
+
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+
+    parquet_path = os.path.join(tmpdir, 'export.parquet')
+    assert export_records(db, parquet_path, chunk_rows=2) == 5
+    parquet = pyarrow.parquet.ParquetFile(parquet_path)
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    assert table.column('cpu_use_percent').to_pylist() == [60.0] * 5
+    assert table.schema.field('end_time').type == pyarrow.timestamp('ms')
+
+
+def test_get_summary():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    lines = [accounting_line(x) for x in range(4)]
+    lines[0] = lines[0].replace(':job0:', ':cromwell_0123abcd_align:')
+    lines[1] = lines[1].replace(':job1:', ':cromwell_89abcdef_align:')
+    lines[2] = lines[2].replace(':alice:', ':bob:')
+    load_data(db, io.StringIO(''.join(lines)))
+
+    by_owner = {x['owner']: dict(x)
+                for x in get_summary(db, ['owner'], days=100000)}
+    assert by_owner['alice']['jobs'] == 3
+    assert by_owner['bob']['jobs'] == 1
+    assert by_owner['alice']['slot_hours'] == 3 * 60 / 3600
+    assert by_owner['alice']['cpu_use_percent'] == 60.0
+    assert by_owner['alice']['memory_use_percent'] == 50.0
+
+    by_job = {x[0]: x['jobs']
+              for x in get_summary(db, ['job'], owner='alice', days=100000)}
+    assert by_job == {'align': 2, 'job3': 1}
+
+    # reading does not create indexes, and works without them
+    db.execute('DROP INDEX accounting__summary')
+    by_owner = {x['owner']: x['jobs']
+                for x in get_summary(db, ['owner'], days=100000)}
+    assert by_owner == {'alice': 3, 'bob': 1}
+    assert db.execute("SELECT 1 FROM sqlite_master WHERE "
+                      "name = 'accounting__summary'").fetchone() is None
+
+
+def test_parse_qstat_xml():
+    testfile = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                            'testfiles', 'uge', 'qstat.xml')
+    with open(testfile, 'rb') as f:
+        jobs = list(parse_qstat_xml(f))
+
+    assert [x.job_id for x in jobs] == \
+        ['1843210', '1843215', '1843215', '1843300']
+    assert jobs[0] == QstatJob(
+        name='cromwell_5f1c2a9b_HaplotypeCaller',
+        job_id='1843210',
+        owner='alice',
+        state='r',
+        slots='4',
+        priority='0.50734',
+        queue_name='all.q@node012',
+        start_time=datetime.datetime(2020, 6, 1, 10, 15, 42, 123000))
+    assert jobs[1].tasks == '7'
+    assert jobs[2].queue_name is None
+    assert jobs[2].tasks == '8-100:1'
+    assert jobs[3].state == 'hqw'
+    assert jobs[3].submission_time == \
+        datetime.datetime(2020, 6, 1, 11, 30, 15)
+
+
+def test_count_tasks():
+    assert count_tasks(None) == (1, None, None)
+    assert count_tasks('7') == (1, 7, 7)
+    assert count_tasks('8-100:1') == (93, 8, 100)
+    assert count_tasks('1-10:4') == (3, 1, 9)
+    assert count_tasks('3,5-6') == (3, 3, 6)
+
+
+def test_aggregate_jobs():
+    testfile = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                            'testfiles', 'uge', 'qstat.xml')
+    with open(testfile, 'rb') as f:
+        groups = aggregate_jobs(parse_qstat_xml(f))
+
+    assert [x.job_id for x in groups] == ['1843210', '1843215', '1843300']
+    array_job = groups[1]
+    assert (array_job.running, array_job.queued, array_job.hold) == \
+        (1, 93, 0)
+    assert array_job.task_range == '7-100'
+    assert array_job.first_start == array_job.last_start
+    assert groups[2].hold == 1
+    assert groups[2].task_range == ''
+
+
+def test_cached_qstat(tmpdir, monkeypatch):
+    calls = []
+
+    def fake_qstat(args=[]):
+        calls.append(args)
+        yield QstatJob(
+            name='job1',
+            job_id='1',
+            owner='alice',
+            state='r',
+            slots='1',
+            priority='0.5',
+            start_time=datetime.datetime(2020, 6, 1, 10, 15, 42, 123000))
+
+    monkeypatch.setattr('cromwellhelper.uge.qstat', fake_qstat)
+    cache_path = os.path.join(tmpdir, 'qstat.json')
+
+    first = list(cached_qstat(cache_path, 60))
+    second = list(cached_qstat(cache_path, 60))
+    assert first == second
+    assert second[0].start_time == \
+        datetime.datetime(2020, 6, 1, 10, 15, 42, 123000)
+    assert len(calls) == 1
+
+    # the whole-cluster result answers filtered queries too
+    list(cached_qstat(cache_path, 60, qstat_args(user='alice')))
+    assert len(calls) == 1
+
+    list(cached_qstat(cache_path, 0))
+    assert len(calls) == 2
+
+    os.remove(cache_path)
+    list(cached_qstat(cache_path, 60, qstat_args(user='alice')))
+    list(cached_qstat(cache_path, 60, qstat_args(user='alice')))
+    assert calls[2:] == [['-u', 'alice']]
+
+    # filtered results do not evict the whole-cluster result
+    list(cached_qstat(cache_path, 60))
+    list(cached_qstat(cache_path, 60, qstat_args(user='bob')))
+    list(cached_qstat(cache_path, 60))
+    assert calls[3:] == [['-u', '*']]
+
+    # the cache may be shared between users
+    old_umask = os.umask(0o022)
+    try:
+        os.remove(cache_path)
+        os.remove(cache_path + '.lock')
+        list(cached_qstat(cache_path, 60))
+    finally:
+        os.umask(old_umask)
+    assert os.stat(cache_path).st_mode & 0o777 == 0o666
+    assert os.stat(cache_path + '.lock').st_mode & 0o777 == 0o666
+
+    # a cache of the wrong shape is a miss and gets rewritten
+    for one in ([], {'version': 1, 'args': ['-u', '*']},
+                {'version': 1, 'args': ['-u', '*'], 'created': time.time(),
+                 'jobs': [['job1']]},
+                {'version': 1, 'args': ['-u', '*'], 'created': 'now'}):
+        with open(cache_path, 'w') as f:
+            json.dump(one, f)
+        count = len(calls)
+        assert len(list(cached_qstat(cache_path, 60))) == 1
+        assert len(calls) == count + 1
+
+    # an unusable cache falls back to qstat
+    missing = os.path.join(tmpdir, 'missing', 'qstat.json')
+    assert len(list(cached_qstat(missing, 60))) == 1
+
+
+def test_qstat_args():
+    assert qstat_args() == ['-u', '*']
+    assert qstat_args(user='alice', state='hqw') == \
+        ['-u', 'alice', '-s', 'p']
+    assert qstat_args(state='Eqw', queue='all.q') == \
+        ['-u', '*', '-q', 'all.q']
+
+
+def test_queue_matches():
+    assert queue_matches('all.q@node012', None)
+    assert queue_matches('all.q@node012', 'all.q')
+    assert queue_matches('all.q@node012', 'short.q,all.q@node012')
+    assert queue_matches('all.q@node012', 'all.q@node0*')
+    assert not queue_matches('all.q@node012', 'all.q@node020')
+    assert not queue_matches('long.q@n2', 'short.q')
+    assert not queue_matches(None, 'short.q')